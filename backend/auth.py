@@ -0,0 +1,58 @@
+import os
+import hmac
+import base64
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Mots de passe hachés avec scrypt (KDF "memory-hard" de la lib standard).
+# Le calcul tourne dans un pool de threads dédié pour ne jamais bloquer la boucle asyncio.
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))  # coût CPU/mémoire (puissance de 2)
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+TAILLE_SEL = 16
+TAILLE_HASH = 32
+PREFIXE_CLAIR = "clair$"  # comptes importés de l'ancien users.json, rehachés à la connexion
+
+_executeur = ThreadPoolExecutor(max_workers=int(os.getenv("AUTH_THREADS", "4")), thread_name_prefix="auth")
+
+
+def _scrypt(mot_de_passe: str, sel: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        mot_de_passe.encode("utf-8"), salt=sel, n=n, r=r, p=p,
+        maxmem=256 * n * r + 1024 * 1024, dklen=TAILLE_HASH,
+    )
+
+
+def hacher(mot_de_passe: str, n: int = SCRYPT_N, r: int = SCRYPT_R, p: int = SCRYPT_P) -> str:
+    sel = os.urandom(TAILLE_SEL)
+    empreinte = _scrypt(mot_de_passe, sel, n, r, p)
+    return f"scrypt${n}${r}${p}${base64.b64encode(sel).decode()}${base64.b64encode(empreinte).decode()}"
+
+
+def verifier(mot_de_passe: str, stocke: str) -> bool:
+    if stocke.startswith(PREFIXE_CLAIR):
+        return hmac.compare_digest(mot_de_passe.encode("utf-8"), stocke[len(PREFIXE_CLAIR):].encode("utf-8"))
+    try:
+        _, n, r, p, sel, empreinte = stocke.split("$")
+        calcule = _scrypt(mot_de_passe, base64.b64decode(sel), int(n), int(r), int(p))
+    except (ValueError, TypeError):
+        return False
+    return hmac.compare_digest(calcule, base64.b64decode(empreinte))
+
+
+def doit_rehacher(stocke: str) -> bool:
+    # vrai pour les anciens mots de passe en clair ou si les paramètres de coût ont changé
+    return not stocke.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+# Empreinte factice : on fait le même calcul quand le compte n'existe pas (temps de réponse identique)
+EMPREINTE_FACTICE = hacher("compte-inexistant")
+
+
+async def hacher_async(mot_de_passe: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executeur, hacher, mot_de_passe)
+
+
+async def verifier_async(mot_de_passe: str, stocke: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(_executeur, verifier, mot_de_passe, stocke)
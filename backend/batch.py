@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import contextvars
+
+# Régénération par lot de la semaine (planning, liste de courses, training) de tous les profils.
+# Usage : python -m backend.batch [--concurrence 10] [--par-minute 300] [--budget-tokens 5000000] [--fenetre 14400]
+# Le point de reprise est écrit après chaque utilisateur : relancer la même commande (même jour ou même
+# --reprise) saute les utilisateurs déjà faits. Chaque utilisateur est écrit en une seule transaction :
+# en cas d'échec, il garde sa semaine précédente. Si l'utilisateur modifie sa semaine pendant qu'on la
+# régénère (coach, /regenerer), ses modifications gagnent : l'utilisateur passe en échec et sera repris.
+DOSSIER_REPRISES = os.getenv("BATCH_DIR", "backend/data/batch")
+# prix OpenRouter en $ par million de tokens (claude-3-haiku), pour l'estimation du coût
+PRIX_ENTREE = 0.25
+PRIX_SORTIE = 1.25
+
+_tokens_utilisateur = contextvars.ContextVar("tokens_utilisateur", default=None)
+
+
+class Limiteur:
+    # Débit global de requêtes vers OpenRouter (espacement régulier) + budget total de tokens
+    def __init__(self, par_minute: float, budget_tokens: int = None):
+        self.intervalle = 60.0 / par_minute if par_minute > 0 else 0.0
+        self.budget_tokens = budget_tokens
+        self.prochain = 0.0
+        self.verrou = asyncio.Lock()
+        self.requetes = 0
+        self.tokens_entree = 0
+        self.tokens_sortie = 0
+
+    async def attendre(self):
+        async with self.verrou:
+            maintenant = time.monotonic()
+            attente = self.prochain - maintenant
+            self.prochain = max(maintenant, self.prochain) + self.intervalle
+        if attente > 0:
+            await asyncio.sleep(attente)
+        self.requetes += 1
+
+    def consommer(self, usage: dict):
+        usage = usage or {}
+        entree, sortie = int(usage.get("prompt_tokens") or 0), int(usage.get("completion_tokens") or 0)
+        self.tokens_entree += entree
+        self.tokens_sortie += sortie
+        par_utilisateur = _tokens_utilisateur.get()
+        if par_utilisateur is not None:
+            par_utilisateur["entree"] += entree
+            par_utilisateur["sortie"] += sortie
+
+    def epuise(self) -> bool:
+        return self.budget_tokens is not None and self.tokens_entree + self.tokens_sortie >= self.budget_tokens
+
+
+def cout(tokens_entree: int, tokens_sortie: int, prix_entree: float, prix_sortie: float) -> float:
+    return round(tokens_entree / 1e6 * prix_entree + tokens_sortie / 1e6 * prix_sortie, 4)
+
+
+def charger_reprise(chemin: str) -> dict:
+    try:
+        with open(chemin, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"cree": time.time(), "utilisateurs": {}}
+
+
+def sauver_reprise(chemin: str, reprise: dict):
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    tmp = chemin + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(reprise, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, chemin)
+
+
+async def regenerer_utilisateur(email: str) -> dict:
+    # Import tardif : backend.main lit LLM_CACHE & co à l'import (voir main())
+    from backend import main, semaine, storage
+    from backend.utils import email_courant, ecritures_differees
+
+    jeton_email = email_courant.set(email)
+    tampon = {}
+    jeton_tampon = ecritures_differees.set(tampon)
+    tokens = {"entree": 0, "sortie": 0}
+    jeton_tokens = _tokens_utilisateur.set(tokens)
+    debut = time.perf_counter()
+    try:
+        # versions de départ : l'écriture finale échoue (ConflitVersion) si l'utilisateur a écrit entre-temps
+        versions = {nom: (storage.etat(nom, email) or (0, None))[0] for nom in storage.DOCUMENTS}
+        formulaire = storage.lire("formulaire", email)
+        await main.generer_semaine(
+            main.prompts_generer(formulaire), formulaire, prompt_semaine=semaine.prompt_semaine(formulaire),
+        )
+        jours_en_erreur = [jour for jour, texte in tampon["planning"]["plannings"].items() if texte.startswith("Erreur IA pour")]
+        if jours_en_erreur:
+            raise RuntimeError(f"jours non générés : {', '.join(jours_en_erreur)}")
+        # tout ou rien : planning, liste et training dans la même transaction
+        with storage.transaction() as db:
+            for nom, contenu in tampon.items():
+                storage.ecrire(nom, contenu, email, db=db, version_attendue=versions[nom])
+        return {"statut": "ok", "duree": round(time.perf_counter() - debut, 2), "tokens": tokens}
+    finally:
+        _tokens_utilisateur.reset(jeton_tokens)
+        ecritures_differees.reset(jeton_tampon)
+        email_courant.reset(jeton_email)
+
+
+async def executer(args) -> dict:
+    from backend import storage, llm
+
+    limiteur = Limiteur(args.par_minute, args.budget_tokens)
+    llm.definir_limiteur(limiteur)
+    reprise = charger_reprise(args.reprise)
+    faits = {email for email, etat in reprise["utilisateurs"].items() if etat.get("statut") == "ok"}
+    emails = [email for email in storage.lister_profils() if email not in faits]
+    if args.limite:
+        emails = emails[:args.limite]
+    print(f"{len(emails)} profils à régénérer ({len(faits)} déjà faits dans {args.reprise})", flush=True)
+
+    semaphore = asyncio.Semaphore(args.concurrence)
+    fin_fenetre = time.monotonic() + args.fenetre if args.fenetre else None
+    compte = {"ok": 0, "echec": 0, "non_traite": 0}
+    debut = time.perf_counter()
+
+    async def traiter(email: str):
+        async with semaphore:
+            # plus de temps ou de budget : on laisse l'utilisateur pour la prochaine exécution
+            if limiteur.epuise() or (fin_fenetre is not None and time.monotonic() > fin_fenetre):
+                compte["non_traite"] += 1
+                return
+            try:
+                resultat = await regenerer_utilisateur(email)
+            except Exception as e:
+                resultat = {"statut": "echec", "erreur": f"{e.__class__.__name__}: {e}"}
+            compte["ok" if resultat["statut"] == "ok" else "echec"] += 1
+            resultat["date"] = time.time()
+            reprise["utilisateurs"][email] = resultat
+            sauver_reprise(args.reprise, reprise)
+            traites = compte["ok"] + compte["echec"]
+            if traites % 50 == 0:
+                print(f"{traites}/{len(emails)} utilisateurs, {limiteur.requetes} requêtes", flush=True)
+
+    try:
+        await asyncio.gather(*(traiter(email) for email in emails))
+    finally:
+        llm.definir_limiteur(None)
+        await llm.fermer_client()
+
+    duree = time.perf_counter() - debut
+    resume = {
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "utilisateurs": compte,
+        "deja_faits": len(faits),
+        "duree_s": round(duree, 1),
+        "utilisateurs_par_minute": round(compte["ok"] / duree * 60, 2) if duree else 0,
+        "requetes": limiteur.requetes,
+        "tokens_entree": limiteur.tokens_entree,
+        "tokens_sortie": limiteur.tokens_sortie,
+        "cout_estime_usd": cout(limiteur.tokens_entree, limiteur.tokens_sortie, args.prix_entree, args.prix_sortie),
+        "budget_epuise": limiteur.epuise(),
+        "echecs": {email: etat["erreur"] for email, etat in reprise["utilisateurs"].items() if etat.get("statut") == "echec"},
+    }
+    reprise.setdefault("executions", []).append(resume)
+    sauver_reprise(args.reprise, reprise)
+    return resume
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Régénère la semaine de tous les utilisateurs")
+    parser.add_argument("--concurrence", type=int, default=10, help="utilisateurs traités en parallèle")
+    parser.add_argument("--par-minute", type=float, default=300, help="requêtes OpenRouter max par minute (tous utilisateurs)")
+    parser.add_argument("--budget-tokens", type=int, default=None, help="arrêt des nouveaux utilisateurs au-delà")
+    parser.add_argument("--fenetre", type=float, default=None, help="durée max (s) pendant laquelle on lance de nouveaux utilisateurs")
+    parser.add_argument("--limite", type=int, default=None, help="nombre max d'utilisateurs (tests)")
+    parser.add_argument("--reprise", default=os.path.join(DOSSIER_REPRISES, f"batch-{time.strftime('%Y-%m-%d')}.json"))
+    parser.add_argument("--prix-entree", type=float, default=PRIX_ENTREE, help="$ par million de tokens d'entrée")
+    parser.add_argument("--prix-sortie", type=float, default=PRIX_SORTIE, help="$ par million de tokens de sortie")
+    parser.add_argument("--cache", action="store_true", help="autoriser les réponses du cache LLM (par défaut : nouvelles semaines)")
+    args = parser.parse_args()
+
+    if not args.cache:
+        os.environ["LLM_CACHE"] = "0"  # avant l'import de backend.llm / backend.cache
+    resume = asyncio.run(executer(args))
+    print(json.dumps(resume, ensure_ascii=False, indent=2))
+    sys.exit(1 if resume["utilisateurs"]["echec"] else 0)
+
+
+if __name__ == "__main__":
+    main()
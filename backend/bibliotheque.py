@@ -0,0 +1,157 @@
+import os
+import re
+import time
+import logging
+import threading
+import unicodedata
+import numpy as np
+from backend import storage, metriques
+from backend.utils import JOURS
+
+# Bibliothèque de semaines déjà générées, indexées par profil : un nouveau profil proche d'un profil connu
+# reçoit tout de suite la semaine de ce dernier, pendant que sa génération personnalisée tourne en tâche de fond.
+# Filtres durs (jamais assouplis) : même régime, mêmes précisions, et allergies de l'utilisateur toutes
+# couvertes par celles du profil d'origine. Ensuite, plus proche voisin sur âge / poids / taille / budget / sexe /
+# activité / objectif (distance euclidienne vectorisée avec NumPy).
+logger = logging.getLogger("monprojetia.bibliotheque")
+
+ACTIVE = os.getenv("BIBLIOTHEQUE", "1") == "1"
+DISTANCE_MAX = float(os.getenv("BIBLIOTHEQUE_DISTANCE_MAX", "1.5"))
+RENOUVELLEMENT = 7 * 24 * 3600  # un profil quasi identique déjà en bibliothèque n'est ré-ajouté qu'au bout d'une semaine
+DISTANCE_DOUBLON = 0.2
+
+# champ -> échelle (une différence d'une "échelle" compte pour 1 dans la distance)
+NUMERIQUES = {"age": 10.0, "poids": 10.0, "taille": 10.0, "budget": 20.0}
+# champ -> (valeurs connues du formulaire, poids)
+CATEGORIES = {
+    "sexe": (["homme", "femme"], 2.0),
+    "activite": (["tres actif", "moyennement actif", "sedentaire"], 1.0),
+    "objectif": (["perte de graisse", "prise de muscle", "performance sportive"], 3.0),
+}
+TAILLE_VECTEUR = len(NUMERIQUES) + sum(len(connues) for connues, _ in CATEGORIES.values())
+VIDES = {"", "aucun", "aucune", "rien", "non", "none", "-", "pas de", "ras", "nan"}
+
+bibliotheque_requetes = metriques.Compteur("bibliotheque_total", "Recherches dans la bibliothèque de semaines", ("resultat",))
+
+
+def _normaliser(texte) -> str:
+    texte = unicodedata.normalize("NFD", str(texte or "").lower())
+    texte = "".join(c for c in texte if unicodedata.category(c) != "Mn")
+    return re.sub(r"\s+", " ", texte).strip(" .!")
+
+
+def _nombre(valeur) -> float:
+    trouve = re.search(r"\d+(?:[.,]\d+)?", str(valeur))
+    return float(trouve.group().replace(",", ".")) if trouve else 0.0
+
+
+def allergies(formulaire: dict) -> frozenset:
+    morceaux = re.split(r"[,;/+]|\bet\b", _normaliser(formulaire.get("allergies")))
+    return frozenset(m.strip() for m in morceaux if m.strip() not in VIDES)
+
+
+def filtre(formulaire: dict) -> str:
+    # clé d'égalité stricte : régime + précisions libres (une contrainte médicale peut s'y cacher)
+    regime = _normaliser(formulaire.get("regime"))
+    precision = _normaliser(formulaire.get("precision"))
+    return f"{'' if regime in VIDES else regime}|{'' if precision in VIDES else precision}"
+
+
+def vecteur(formulaire: dict) -> np.ndarray:
+    valeurs = [_nombre(formulaire.get(champ)) / echelle for champ, echelle in NUMERIQUES.items()]
+    for champ, (connues, poids) in CATEGORIES.items():
+        valeur = _normaliser(formulaire.get(champ))
+        valeurs += [poids if valeur == connue else 0.0 for connue in connues]
+    return np.array(valeurs, dtype=np.float32)
+
+
+def training_compatible(profil: dict, formulaire: dict) -> bool:
+    # le training dépend des jours de sport et du temps disponible : on ne le réutilise que s'ils sont identiques
+    return (
+        sorted(profil.get("jours_sport") or []) == sorted(formulaire.get("jours_sport") or [])
+        and _nombre(profil.get("temps_dispo")) == _nombre(formulaire.get("temps_dispo"))
+        and _normaliser(profil.get("sport_actuel")) == _normaliser(formulaire.get("sport_actuel"))
+    )
+
+
+class Index:
+    # Vecteurs en mémoire, groupés par filtre ; complété avec les nouvelles lignes de la base à chaque recherche
+    # (autres workers, autres process compris)
+    def __init__(self):
+        self.groupes = {}  # filtre -> {"ids", "allergies", "crees", "matrice"}
+        self.dernier_id = 0
+        self.verrou = threading.Lock()
+
+    def rafraichir(self):
+        with self.verrou:
+            nouvelles = storage.index_bibliotheque(self.dernier_id)
+            if not nouvelles:
+                return
+            modifies = set()
+            for id_modele, cle, allergies_modele, brut, cree in nouvelles:
+                self.dernier_id = id_modele
+                vecteur_modele = np.frombuffer(brut, dtype=np.float32)
+                if len(vecteur_modele) != TAILLE_VECTEUR:
+                    continue  # ligne écrite avec d'anciens champs : ignorée
+                groupe = self.groupes.setdefault(cle, {"ids": [], "allergies": [], "crees": [], "vecteurs": [], "matrice": None})
+                groupe["ids"].append(id_modele)
+                groupe["allergies"].append(frozenset(allergies_modele))
+                groupe["crees"].append(cree)
+                groupe["vecteurs"].append(vecteur_modele)
+                modifies.add(cle)
+            for cle in modifies:
+                groupe = self.groupes[cle]
+                groupe["matrice"] = np.vstack(groupe["vecteurs"])
+
+    def plus_proche(self, formulaire: dict):
+        # -> (id, distance, cree) du modèle compatible le plus proche, ou None
+        self.rafraichir()
+        groupe = self.groupes.get(filtre(formulaire))
+        if groupe is None:
+            return None
+        besoin = allergies(formulaire)
+        compatibles = np.fromiter((besoin <= a for a in groupe["allergies"]), dtype=bool, count=len(groupe["ids"]))
+        if not compatibles.any():
+            return None
+        distances = np.linalg.norm(groupe["matrice"] - vecteur(formulaire), axis=1)
+        distances[~compatibles] = np.inf
+        i = int(np.argmin(distances))
+        return groupe["ids"][i], float(distances[i]), groupe["crees"][i]
+
+
+index = Index()
+
+
+def chercher(formulaire: dict):
+    # Semaine prête à servir pour ce profil : {"planning", "liste", "training" (ou None), "distance"} ou None
+    if not ACTIVE:
+        return None
+    debut = time.perf_counter()
+    trouve = index.plus_proche(formulaire)
+    if trouve is None or trouve[1] > DISTANCE_MAX:
+        bibliotheque_requetes.inc(resultat="manque")
+        return None
+    modele = storage.lire_bibliotheque(trouve[0])
+    if modele is None:
+        return None
+    if not training_compatible(modele["profil"], formulaire):
+        modele["training"] = None
+    modele["distance"] = round(trouve[1], 3)
+    bibliotheque_requetes.inc(resultat="servi")
+    logger.info("Semaine servie depuis la bibliothèque (distance %s, %.1f ms)", modele["distance"], (time.perf_counter() - debut) * 1000)
+    return modele
+
+
+def ajouter(formulaire: dict, planning: dict, liste: dict, training: dict = None):
+    # Appelé après une génération complète réussie ; les semaines incomplètes ne sont pas gardées
+    if not ACTIVE:
+        return None
+    plannings = planning.get("plannings", {})
+    if any(jour not in plannings or plannings[jour].startswith("Erreur IA pour") for jour in JOURS):
+        return None
+    proche = index.plus_proche(formulaire)
+    if proche is not None and proche[1] < DISTANCE_DOUBLON and time.time() - proche[2] < RENOUVELLEMENT:
+        return None
+    return storage.ajouter_bibliotheque(
+        filtre(formulaire), sorted(allergies(formulaire)), vecteur(formulaire).tobytes(), formulaire, planning, liste, training,
+    )
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+# Cache des réponses IA : un niveau mémoire (LRU) devant un niveau disque, clé = hash(modèle, messages, paramètres)
+# Depuis la boucle asyncio seul le niveau mémoire est traité sur place : lectures disque (lire_async), écritures
+# et éviction passent dans le pool de threads.
+logger = logging.getLogger("monprojetia.cache")
+CACHE_DIR = "backend/data/cache"
+CACHE_ACTIF = os.getenv("LLM_CACHE", "1") == "1"
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MEMOIRE_MAX = int(os.getenv("LLM_CACHE_MEMOIRE_MAX", "500"))  # nombre d'entrées
+CACHE_DISQUE_MAX = int(os.getenv("LLM_CACHE_DISQUE_MAX", str(200 * 1024 * 1024)))  # octets
+NETTOYAGE_TOUS_LES = 100  # écritures entre deux passages d'éviction sur disque
+
+
+def calculer_cle(data: dict) -> str:
+    # `stream` ne change pas le contenu de la réponse : on l'ignore pour partager les entrées
+    contenu = {k: v for k, v in data.items() if k != "stream"}
+    return hashlib.sha256(json.dumps(contenu, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class CacheLLM:
+    def __init__(self, dossier: str, ttl: float, memoire_max: int, disque_max: int):
+        self.dossier = dossier
+        self.ttl = ttl
+        self.memoire_max = memoire_max
+        self.disque_max = disque_max
+        self.memoire = OrderedDict()  # cle -> (expire, valeur)
+        self.verrou = threading.Lock()
+        self.nettoyage = threading.Lock()  # un seul passage d'éviction à la fois
+        self.en_attente = set()  # écritures disque lancées dans le pool de threads
+        self.ecritures = 0
+        self.compteurs = {"hit_memoire": 0, "hit_disque": 0, "miss": 0, "ecritures": 0, "evictions": 0}
+
+    def _chemin(self, cle: str) -> str:
+        return os.path.join(self.dossier, cle[:2], f"{cle}.json")
+
+    def _lire_memoire(self, cle: str):
+        with self.verrou:
+            entree = self.memoire.get(cle)
+            if entree is not None:
+                if entree[0] > time.time():
+                    self.memoire.move_to_end(cle)
+                    self.compteurs["hit_memoire"] += 1
+                    return entree[1]
+                del self.memoire[cle]
+        return None
+
+    def lire(self, cle: str):
+        valeur = self._lire_memoire(cle)
+        return valeur if valeur is not None else self._lire_disque(cle)
+
+    async def lire_async(self, cle: str):
+        valeur = self._lire_memoire(cle)
+        return valeur if valeur is not None else await asyncio.to_thread(self._lire_disque, cle)
+
+    def _lire_disque(self, cle: str):
+        maintenant = time.time()
+        try:
+            with open(self._chemin(cle), "r", encoding="utf-8") as f:
+                entree = json.load(f)
+        except (OSError, ValueError):
+            entree = None
+
+        with self.verrou:
+            if entree is None or entree["expire"] <= maintenant:
+                self.compteurs["miss"] += 1
+                return None
+            self.compteurs["hit_disque"] += 1
+            self._garder_en_memoire(cle, entree["expire"], entree["valeur"])
+            return entree["valeur"]
+
+    def ecrire(self, cle: str, valeur: str):
+        # Niveau mémoire tout de suite ; le disque (et l'éviction) en arrière-plan si on est dans la boucle
+        expire = time.time() + self.ttl
+        with self.verrou:
+            self._garder_en_memoire(cle, expire, valeur)
+            self.compteurs["ecritures"] += 1
+            self.ecritures += 1
+            nettoyer = self.ecritures % NETTOYAGE_TOUS_LES == 0
+        try:
+            boucle = asyncio.get_running_loop()
+        except RuntimeError:
+            self._ecrire_disque(cle, expire, valeur, nettoyer)
+            return
+        future = boucle.run_in_executor(None, self._ecrire_disque, cle, expire, valeur, nettoyer)
+        self.en_attente.add(future)
+        future.add_done_callback(self.en_attente.discard)
+
+    async def terminer_ecritures(self):
+        # À l'arrêt : on attend les écritures disque encore en cours
+        if self.en_attente:
+            await asyncio.gather(*list(self.en_attente), return_exceptions=True)
+
+    def _ecrire_disque(self, cle: str, expire: float, valeur: str, nettoyer: bool):
+        chemin = self._chemin(cle)
+        try:
+            os.makedirs(os.path.dirname(chemin), exist_ok=True)
+            tmp = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"expire": expire, "valeur": valeur}, f, ensure_ascii=False)
+            os.replace(tmp, chemin)
+        except OSError as e:
+            logger.warning("Écriture du cache impossible : %s", e)
+        if nettoyer and self.nettoyage.acquire(blocking=False):
+            try:
+                self.nettoyer_disque()
+            finally:
+                self.nettoyage.release()
+
+    def _garder_en_memoire(self, cle: str, expire: float, valeur: str):
+        self.memoire[cle] = (expire, valeur)
+        self.memoire.move_to_end(cle)
+        while len(self.memoire) > self.memoire_max:
+            self.memoire.popitem(last=False)
+            self.compteurs["evictions"] += 1
+
+    def nettoyer_disque(self):
+        # Supprime les entrées expirées puis les plus anciennes tant qu'on dépasse la taille max
+        if not os.path.isdir(self.dossier):
+            return
+        maintenant = time.time()
+        fichiers = []
+        for racine, _, noms in os.walk(self.dossier):
+            for nom in noms:
+                chemin = os.path.join(racine, nom)
+                try:
+                    infos = os.stat(chemin)
+                except OSError:
+                    continue
+                if infos.st_mtime + self.ttl <= maintenant:
+                    self._supprimer(chemin)
+                else:
+                    fichiers.append((infos.st_mtime, infos.st_size, chemin))
+
+        total = sum(taille for _, taille, _ in fichiers)
+        for _, taille, chemin in sorted(fichiers):
+            if total <= self.disque_max:
+                break
+            self._supprimer(chemin)
+            total -= taille
+
+    def _supprimer(self, chemin: str):
+        try:
+            os.remove(chemin)
+        except OSError:
+            return
+        with self.verrou:
+            self.compteurs["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self.verrou:
+            stats = dict(self.compteurs)
+            stats["entrees_memoire"] = len(self.memoire)
+        lectures = stats["hit_memoire"] + stats["hit_disque"] + stats["miss"]
+        stats["taux_hit"] = round((stats["hit_memoire"] + stats["hit_disque"]) / lectures, 3) if lectures else 0.0
+        return stats
+
+
+cache_llm = CacheLLM(CACHE_DIR, CACHE_TTL, CACHE_MEMOIRE_MAX, CACHE_DISQUE_MAX)
@@ -0,0 +1,32 @@
+import json
+import asyncio
+import hashlib
+
+# Outils de concurrence par utilisateur (dans un process) :
+# - verrou(email) : sérialise les lectures-modifications-écritures du planning et de la liste d'un utilisateur ;
+# - unique(cle, fabrique) : "single-flight", deux demandes identiques en cours partagent le même résultat.
+# Entre plusieurs workers uvicorn, c'est le numéro de version de storage.ecrire qui détecte les conflits.
+_verrous = {}
+_en_vol = {}
+
+
+def empreinte(*morceaux) -> str:
+    texte = json.dumps(morceaux, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(texte.encode("utf-8")).hexdigest()
+
+
+def verrou(email: str) -> asyncio.Lock:
+    cle = email or ""
+    if cle not in _verrous:
+        _verrous[cle] = asyncio.Lock()
+    return _verrous[cle]
+
+
+async def unique(cle: str, fabrique):
+    # `fabrique()` renvoie la coroutine à lancer ; les appels suivants avec la même clé attendent son résultat.
+    # shield : si le premier demandeur part (navigateur fermé), les autres ont quand même leur réponse.
+    if cle not in _en_vol:
+        tache = asyncio.ensure_future(fabrique())
+        _en_vol[cle] = tache
+        tache.add_done_callback(lambda _: _en_vol.pop(cle, None))
+    return await asyncio.shield(_en_vol[cle])
@@ -0,0 +1,270 @@
+import re
+import logging
+from backend.semaine import REPAS
+
+# Liste de courses calculée localement à partir des repas : chaque jour est découpé en articles
+# {nom, quantite, unite, categorie}, puis la semaine est additionnée (g, ml ou pièces).
+# Les morceaux avec un nombre qu'on n'arrive pas à lire sont gardés dans "non_lus" et affichés à part.
+logger = logging.getLogger("monprojetia.courses")
+
+# unité lue -> (unité normalisée, facteur)
+UNITES = {
+    "kg": ("g", 1000), "g": ("g", 1), "gr": ("g", 1), "gramme": ("g", 1), "grammes": ("g", 1),
+    "mg": ("g", 0.001),
+    "l": ("ml", 1000), "litre": ("ml", 1000), "litres": ("ml", 1000),
+    "dl": ("ml", 100), "cl": ("ml", 10), "ml": ("ml", 1),
+    "c. à soupe": ("c. à soupe", 1), "c. à café": ("c. à café", 1),
+    "tranche": ("tranche", 1), "pincée": ("pincée", 1), "gousse": ("gousse", 1),
+}
+_UNITE = (
+    r"kg|mg|gr|grammes?|g|litres?|dl|cl|ml|l"
+    r"|c\.?\s?à\s?s(?:oupe)?\.?|c\.?\s?à\s?c(?:afé)?\.?|cs|cc|cuill[èe]res?\s+à\s+(?:soupe|café)"
+    r"|tranches?|pincées?|gousses?"
+)
+# "80", "1,5", "1/2", et les fourchettes "70-80" / "3 à 4" (on garde le haut de la fourchette)
+_NOMBRE = r"\d+(?:[.,]\d+)?(?:\s*/\s*\d+|\s*(?:-|–|à)\s*\d+(?:[.,]\d+)?)?"
+RE_QUANTITE_DEBUT = re.compile(rf"^(?P<q>{_NOMBRE})\s*(?P<u>{_UNITE})?\.?\s+(?:de\s+|d['’]\s*)?(?P<nom>.+)$", re.I)
+RE_QUANTITE_FIN = re.compile(rf"^(?P<nom>.+?)\s*[:(–\-]?\s*(?P<q>{_NOMBRE})\s*(?P<u>{_UNITE})?\)?\.?$", re.I)
+RE_REPAS = re.compile(r"^(?:matin|midi|soir|petit[- ]d[ée]jeuner|d[ée]jeuner|d[îi]ner|collation|go[ûu]ter|repas)\b[^:]*:\s*", re.I)
+# la virgule décimale ("1,5 kg") n'est pas un séparateur
+RE_SEPARATEURS = re.compile(r"(?<!\d),|,(?!\d)|;|\+", re.I)
+# "et" / "avec" ne coupent que si chaque côté a sa quantité ("Salade verte et tomates : 150 g" reste entier)
+RE_LIAISONS = re.compile(r"(\s+(?:et|avec)\s+)", re.I)
+RE_PARENTHESES = re.compile(r"\s*\(([^()]*)\)")
+RE_QUANTITE_SEULE = re.compile(rf"^(?:environ|env\.|~|soit)?\s*(?P<q>{_NOMBRE})\s*(?P<u>{_UNITE})\.?$", re.I)
+# lignes de macros, pas des ingrédients
+RE_HORS_COURSES = re.compile(r"kcal|calories?\b|\btotal\b", re.I)
+
+# mots invariables qu'on ne met pas au singulier
+INVARIABLES = {"ananas", "pois", "maïs", "jus", "radis", "cassis", "anis", "frais", "gras", "épais", "dos"}
+
+CATEGORIES = [
+    ("🥦 Fruits et légumes", [
+        "pomme", "banane", "orange", "citron", "fraise", "framboise", "myrtille", "kiwi", "poire", "raisin", "mangue",
+        "ananas", "abricot", "pêche", "fruit", "légume", "salade", "laitue", "épinard", "tomate", "carotte", "courgette",
+        "brocoli", "chou", "haricot vert", "poivron", "oignon", "ail", "échalote", "concombre", "aubergine", "champignon",
+        "poireau", "avocat", "patate douce", "betterave", "radis", "céleri", "petits pois", "herbe", "persil", "basilic",
+    ]),
+    ("🍗 Viandes, poissons et œufs", [
+        "poulet", "dinde", "boeuf", "bœuf", "steak", "veau", "porc", "jambon", "lardon", "saucisse", "viande", "canard",
+        "poisson", "saumon", "thon", "cabillaud", "colin", "merlu", "sardine", "maquereau", "crevette", "oeuf", "œuf",
+    ]),
+    ("🧀 Produits laitiers", [
+        "lait", "yaourt", "yogourt", "fromage", "skyr", "beurre", "crème", "emmental", "mozzarella", "feta", "ricotta",
+        "comté", "parmesan", "chèvre",
+    ]),
+    ("🍞 Féculents et céréales", [
+        "riz", "pâte", "spaghetti", "semoule", "quinoa", "boulgour", "pomme de terre", "pain", "flocon", "avoine",
+        "céréale", "muesli", "farine", "tortilla", "lentille", "pois chiche", "haricot rouge", "haricot blanc", "blé",
+    ]),
+    ("🫙 Épicerie", [
+        "huile", "vinaigre", "sel", "poivre", "épice", "sucre", "miel", "confiture", "chocolat", "amande", "noix",
+        "noisette", "cacahuète", "beurre de cacahuète", "graine", "sauce", "moutarde", "bouillon", "compote", "cannelle",
+    ]),
+    ("🥤 Boissons", ["jus", "café", "thé", "eau", "boisson", "smoothie"]),
+]
+AUTRES = "🛒 Autres"
+
+
+def _nombre(texte: str) -> float:
+    texte = texte.replace(",", ".").replace(" ", "")
+    fourchette = re.split(r"-|–|à", texte)
+    if len(fourchette) == 2:
+        return max(float(fourchette[0]), float(fourchette[1]))
+    if "/" in texte:
+        haut, bas = texte.split("/", 1)
+        return float(haut) / float(bas) if float(bas) else 0.0
+    return float(texte)
+
+
+def _unite(brute: str):
+    if not brute:
+        return "pièce", 1
+    brute = re.sub(r"\s+", " ", brute.lower()).rstrip(".")
+    if brute in ("cs",) or "soupe" in brute or re.fullmatch(r"c\.? ?à ?s", brute):
+        brute = "c. à soupe"
+    elif brute in ("cc",) or "café" in brute or re.fullmatch(r"c\.? ?à ?c", brute):
+        brute = "c. à café"
+    elif brute.endswith("s") and brute[:-1] in UNITES:
+        brute = brute[:-1]
+    return UNITES.get(brute, ("pièce", 1))
+
+
+def normaliser_nom(nom: str) -> str:
+    nom = re.sub(r"\(.*?\)", "", nom.lower())
+    nom = re.sub(r"^(?:(?:environ|de|du|des|la|le|les)\s+|d['’]\s*)+", "", nom.strip())
+    nom = nom.strip(" .:-–*•")
+    mots = []
+    for mot in nom.split():
+        if len(mot) > 3 and mot.endswith("s") and mot not in INVARIABLES:
+            mot = mot[:-1]
+        mots.append(mot)
+    return " ".join(mots)
+
+
+def categorie(nom: str) -> str:
+    # on prend le mot-clé le plus long qui correspond ("pomme de terre" avant "pomme")
+    meilleure, longueur = AUTRES, 0
+    for nom_categorie, mots_cles in CATEGORIES:
+        for mot_cle in mots_cles:
+            if mot_cle in nom and len(mot_cle) > longueur:
+                meilleure, longueur = nom_categorie, len(mot_cle)
+    return meilleure
+
+
+def article(nom: str, quantite: float, unite: str) -> dict:
+    nom = normaliser_nom(nom)
+    return {"nom": nom, "quantite": round(quantite, 2), "unite": unite, "categorie": categorie(nom)}
+
+
+def _quantite(q: str, u: str):
+    unite, facteur = _unite(u)
+    try:
+        return _nombre(q) * facteur, unite
+    except ValueError:
+        return 0, unite
+
+
+def _lire_morceau(morceau: str):
+    morceau = re.sub(r"^(?:environ|env\.|~)\s*", "", morceau.strip(" \t-–*•."), flags=re.I)
+    # "(60 g)" après "2 tranches" est plus précis : on le préfère ; les autres parenthèses ("poids cru") sautent
+    precise = None
+    for contenu in RE_PARENTHESES.findall(morceau):
+        precise = precise or RE_QUANTITE_SEULE.match(contenu.strip())
+    morceau = RE_PARENTHESES.sub("", morceau).strip(" \t-–*•.")
+    if not morceau or (precise is None and not re.search(r"\d", morceau)):
+        return None
+    nom = quantite = None
+    for motif in (RE_QUANTITE_DEBUT, RE_QUANTITE_FIN):
+        trouve = motif.match(morceau)
+        if trouve and re.search(r"[a-zà-ÿ]", trouve.group("nom"), re.I):
+            nom = trouve.group("nom")
+            quantite, unite = _quantite(trouve.group("q"), trouve.group("u"))
+            break
+    if nom is None:
+        if precise is None or re.search(r"\d", morceau):
+            return None
+        nom = morceau  # "Riz basmati (80 g)"
+    if precise is not None:
+        quantite, unite = _quantite(precise.group("q"), precise.group("u"))
+    resultat = article(nom, quantite, unite)
+    return resultat if resultat["nom"] and quantite > 0 else None
+
+
+def _morceaux(ligne: str) -> list:
+    morceaux = []
+    for bloc in RE_SEPARATEURS.split(ligne):
+        en_cours = ""
+        parties = RE_LIAISONS.split(bloc)  # [morceau, liaison, morceau, ...]
+        for i in range(0, len(parties), 2):
+            en_cours = en_cours + parties[i - 1] + parties[i] if en_cours else parties[i]
+            if re.search(r"\d", en_cours):
+                morceaux.append(en_cours)
+                en_cours = ""
+        if en_cours:
+            morceaux.append(en_cours)
+    return morceaux
+
+
+def parser_jour(texte: str, non_lus: list = None) -> list:
+    # Texte libre d'un jour -> articles. Les morceaux sans aucun nombre sont ignorés ("Eau à volonté") ;
+    # ceux avec un nombre illisible sont ajoutés à `non_lus`.
+    articles = []
+    for ligne in texte.splitlines():
+        ligne = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s+", "", ligne)
+        ligne = RE_REPAS.sub("", ligne.strip())
+        for morceau in _morceaux(ligne):
+            resultat = _lire_morceau(morceau)
+            if resultat is not None:
+                articles.append(resultat)
+            elif non_lus is not None and re.search(r"\d", morceau) and not RE_HORS_COURSES.search(morceau):
+                non_lus.append(morceau.strip(" \t-–*•."))
+    return articles
+
+
+def depuis_structure(repas: dict) -> list:
+    # Jour déjà structuré (mode "semaine") : pas besoin de parser
+    return [article(aliment["aliment"], float(aliment["grammes"]), "g") for nom in REPAS for aliment in repas[nom]]
+
+
+def articles_du_jour(texte: str, repas: dict = None, non_lus: list = None) -> list:
+    return depuis_structure(repas) if repas else parser_jour(texte, non_lus)
+
+
+def _cle(article_: dict) -> str:
+    return f"{article_['nom']}|{article_['unite']}"
+
+
+def ajouter(totaux: dict, articles: list, signe: int = 1):
+    # totaux : {"nom|unite": article} ; signe=-1 pour retirer un jour
+    for a in articles:
+        cle = _cle(a)
+        total = totaux.setdefault(cle, dict(a, quantite=0))
+        total["quantite"] = round(total["quantite"] + signe * a["quantite"], 2)
+        if total["quantite"] <= 0:
+            del totaux[cle]
+
+
+def _format_quantite(quantite: float, unite: str) -> str:
+    if unite == "g" and quantite >= 1000:
+        return f"{quantite / 1000:.2f}".rstrip("0").rstrip(".") + " kg"
+    if unite == "ml" and quantite >= 1000:
+        return f"{quantite / 1000:.2f}".rstrip("0").rstrip(".") + " L"
+    valeur = f"{quantite:.1f}".rstrip("0").rstrip(".")
+    if unite == "pièce":
+        return valeur
+    return f"{valeur} {unite}"
+
+
+def rendre_liste(totaux: dict, non_lus: dict = None) -> str:
+    ordre = [nom for nom, _ in CATEGORIES] + [AUTRES]
+    par_categorie = {}
+    for a in totaux.values():
+        par_categorie.setdefault(a["categorie"], []).append(a)
+    blocs = []
+    for nom_categorie in ordre:
+        articles = sorted(par_categorie.get(nom_categorie, []), key=lambda a: a["nom"])
+        if articles:
+            lignes = [f"{nom_categorie} :"] + [f"- {a['nom']} : {_format_quantite(a['quantite'], a['unite'])}" for a in articles]
+            blocs.append("\n".join(lignes))
+    a_verifier = [f"- {morceau} ({jour})" for jour, morceaux in (non_lus or {}).items() for morceau in morceaux]
+    if a_verifier:
+        blocs.append("\n".join(["⚠️ À vérifier (quantité non reconnue) :"] + a_verifier))
+    return "\n\n".join(blocs) if blocs else "Aucun ingrédient trouvé dans le planning."
+
+
+def _signaler(non_lus: dict):
+    total = sum(len(morceaux) for morceaux in non_lus.values())
+    if total:
+        logger.warning("%s ingrédient(s) non reconnus dans la liste de courses", total)
+
+
+def construire(plannings: dict, structure: dict = None) -> dict:
+    # Contenu complet de liste.json : texte affiché + détail par jour pour les mises à jour incrémentales
+    structure = structure or {}
+    non_lus = {jour: [] for jour in plannings}
+    par_jour = {jour: articles_du_jour(texte, structure.get(jour), non_lus[jour]) for jour, texte in plannings.items()}
+    totaux = {}
+    for articles in par_jour.values():
+        ajouter(totaux, articles)
+    non_lus = {jour: morceaux for jour, morceaux in non_lus.items() if morceaux}
+    _signaler(non_lus)
+    return {"liste": rendre_liste(totaux, non_lus), "par_jour": par_jour, "totaux": totaux, "non_lus": non_lus}
+
+
+def remplacer_jours(liste_json: dict, plannings: dict, jours: list, structure: dict = None) -> dict:
+    # On retire les anciens articles des jours modifiés et on ajoute les nouveaux
+    structure = structure or {}
+    totaux = liste_json["totaux"]
+    non_lus = liste_json.setdefault("non_lus", {})
+    for jour in jours:
+        ajouter(totaux, liste_json["par_jour"].get(jour, []), signe=-1)
+        non_lus[jour] = []
+        nouveaux = articles_du_jour(plannings.get(jour, ""), structure.get(jour), non_lus[jour])
+        liste_json["par_jour"][jour] = nouveaux
+        ajouter(totaux, nouveaux)
+        if not non_lus[jour]:
+            del non_lus[jour]
+    _signaler({jour: non_lus[jour] for jour in jours if jour in non_lus})
+    liste_json["liste"] = rendre_liste(totaux, non_lus)
+    return liste_json
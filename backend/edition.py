@@ -0,0 +1,72 @@
+import re
+from backend.llm import completer
+from backend.semaine import extraire_json
+
+# Modifications du coach en mode "patch" : on envoie le texte actuel (jour ou training) + la demande,
+# l'IA renvoie seulement les lignes à changer en JSON, et le remplacement est fait ici.
+# Beaucoup moins de tokens en sortie qu'une régénération complète, et le reste du jour ne bouge pas.
+
+
+class ErreurPatch(ValueError):
+    pass
+
+
+def prompt_patch(texte: str, instruction: str, contexte: str = "") -> str:
+    exemple = (
+        '{"modifications": [{"remplacer": "- saumon : 150 g", "par": "- blanc de poulet : 150 g"}, '
+        '{"supprimer": "- pain : 40 g"}, {"apres": "Midi :", "ajouter": "- riz : 80 g"}]}'
+    )
+    return (
+        f"Voici un texte :\n\n{texte}\n\n"
+        f"Demande de l’utilisateur : \"{instruction}\"\n"
+        f"{contexte}\n"
+        "Applique la demande en changeant le MINIMUM de lignes. Ne réécris pas le texte : réponds uniquement avec un "
+        f"objet JSON de la forme {exemple}. Les valeurs de \"remplacer\", \"supprimer\" et \"apres\" doivent être des "
+        "lignes recopiées exactement depuis le texte. Si rien n’est à changer, réponds {\"modifications\": []}."
+    )
+
+
+def _normaliser(ligne: str) -> str:
+    return re.sub(r"\s+", " ", ligne.strip().lower())
+
+
+def _trouver(lignes: list, cible: str) -> int:
+    # ligne identique (espaces et casse ignorés), sinon première ligne qui la contient
+    cible = _normaliser(cible)
+    if not cible:
+        raise ErreurPatch("ligne cible vide")
+    normalisees = [_normaliser(ligne) for ligne in lignes]
+    if cible in normalisees:
+        return normalisees.index(cible)
+    for i, ligne in enumerate(normalisees):
+        if cible in ligne:
+            return i
+    raise ErreurPatch(f"ligne introuvable : {cible}")
+
+
+def appliquer(texte: str, modifications: list) -> str:
+    lignes = texte.splitlines()
+    for modif in modifications:
+        if not isinstance(modif, dict):
+            raise ErreurPatch("modification invalide")
+        if "remplacer" in modif:
+            i = _trouver(lignes, str(modif["remplacer"]))
+            lignes[i:i + 1] = str(modif.get("par", "")).splitlines()
+        elif "supprimer" in modif:
+            del lignes[_trouver(lignes, str(modif["supprimer"]))]
+        elif "ajouter" in modif:
+            nouvelles = str(modif["ajouter"]).splitlines()
+            i = _trouver(lignes, str(modif["apres"])) + 1 if modif.get("apres") else len(lignes)
+            lignes[i:i] = nouvelles
+        else:
+            raise ErreurPatch("modification inconnue")
+    return "\n".join(lignes)
+
+
+async def editer(texte: str, instruction: str, contexte: str = "") -> str:
+    # Lève ErreurPatch si la réponse n'est pas applicable : à l'appelant de régénérer en entier
+    reponse = await completer(prompt_patch(texte, instruction, contexte), etape="edition")
+    donnees = extraire_json(reponse)
+    if not isinstance(donnees, dict) or not isinstance(donnees.get("modifications"), list):
+        raise ErreurPatch("réponse non JSON")
+    return appliquer(texte, donnees["modifications"])
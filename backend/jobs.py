@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+from backend.utils import email_courant
+from backend import metriques, concurrence
+
+logger = logging.getLogger("monprojetia.jobs")
+
+JOBS_DIR = os.getenv("JOBS_DIR", "backend/data/jobs")
+NB_WORKERS = max(1, int(os.getenv("JOBS_WORKERS", "4")))
+FILE_MAX = max(1, int(os.getenv("JOBS_FILE_MAX", "100")))  # au-delà on refuse les nouvelles demandes
+TENTATIVES_MAX = max(1, int(os.getenv("JOBS_TENTATIVES", "2")))  # exécutions max, reprises après redémarrage comprises
+CONSERVATION = 7 * 24 * 3600  # les jobs finis sont purgés au bout d'une semaine
+
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINE = "termine"
+ECHOUE = "echoue"
+
+_handlers = {}
+_jobs = {}
+_abonnes = {}  # job_id -> files d'évènements des navigateurs connectés en SSE
+_file = None
+_workers = []
+
+
+class FileSaturee(Exception):
+    pass
+
+
+def enregistrer(type_job: str, fonction):
+    # `fonction(job, progression)` : coroutine qui fait le travail,
+    # `progression(etape, statut, resultat=None)` met à jour le suivi
+    _handlers[type_job] = fonction
+
+
+def _chemin(job_id: str) -> str:
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _sauver(job: dict):
+    job["maj"] = time.time()
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    tmp = _chemin(job["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, _chemin(job["id"]))
+
+
+def _empreinte(type_job: str, email: str, entree: dict, cle) -> str:
+    return concurrence.empreinte(type_job, email, cle if cle is not None else entree)
+
+
+def en_vol(type_job: str, email: str, entree: dict, cle=None):
+    # Job identique encore en attente ou en cours, sinon None
+    empreinte = _empreinte(type_job, email, entree, cle)
+    for job in _jobs.values():
+        if job.get("cle") == empreinte and job["statut"] in (EN_ATTENTE, EN_COURS):
+            return job
+    return None
+
+
+def soumettre(type_job: str, email: str, entree: dict, etapes=(), cle=None) -> dict:
+    # Une demande identique (même type, utilisateur et entrée) encore en cours n'est pas relancée :
+    # on renvoie le job existant (double clic sur "Générer", rechargement de la page...).
+    # `cle` : ce qui détermine le résultat, si ce n'est pas seulement `entree`.
+    existant = en_vol(type_job, email, entree, cle)
+    if existant is not None:
+        logger.info("Job %s déjà en cours pour cette demande", existant["id"])
+        return existant
+    cle = _empreinte(type_job, email, entree, cle)
+    if _file is None or _file.full():
+        raise FileSaturee("Trop de générations en attente")
+    job = {
+        "id": uuid.uuid4().hex,
+        "type": type_job,
+        "email": email,
+        "entree": entree,
+        "cle": cle,
+        "statut": EN_ATTENTE,
+        "etapes": {etape: EN_ATTENTE for etape in etapes},
+        "resultats": {},
+        "erreur": None,
+        "tentatives": 0,
+        "cree": time.time(),
+        # demande tracée (en-tête X-Trace) : le job l'est aussi, la trace est gardée dans job["trace"]
+        "tracer": metriques.trace_courante.get() is not None,
+    }
+    _jobs[job["id"]] = job
+    _sauver(job)
+    _file.put_nowait(job["id"])
+    return job
+
+
+def abonner(job_id: str) -> asyncio.Queue:
+    file = asyncio.Queue()
+    _abonnes.setdefault(job_id, set()).add(file)
+    return file
+
+
+def desabonner(job_id: str, file: asyncio.Queue):
+    abonnes = _abonnes.get(job_id)
+    if abonnes is not None:
+        abonnes.discard(file)
+        if not abonnes:
+            del _abonnes[job_id]
+
+
+def publier(job_id: str, evenement: dict):
+    for file in _abonnes.get(job_id, ()):
+        file.put_nowait(evenement)
+
+
+def lire(job_id: str):
+    if job_id in _jobs:
+        return _jobs[job_id]
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_chemin(job_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+async def _executer(job: dict):
+    job["statut"] = EN_COURS
+    job["tentatives"] += 1
+    _sauver(job)
+
+    def progression(etape, statut, resultat=None):
+        job["etapes"][etape] = statut
+        if statut == TERMINE and isinstance(resultat, str):
+            # gardé pour reprendre sans refaire l'étape après un redémarrage
+            job["resultats"][etape] = resultat
+        _sauver(job)
+        publier(job["id"], {"type": "etape", "etape": etape, "statut": statut, "texte": resultat if isinstance(resultat, str) else None})
+
+    jeton = email_courant.set(job["email"])
+    jeton_trace = metriques.demarrer_trace() if job.get("tracer") else None
+    try:
+        await _handlers[job["type"]](job, progression)
+        job["statut"] = TERMINE
+    except Exception as e:
+        logger.exception("Job %s (%s) en échec", job["id"], job["type"])
+        job["statut"] = ECHOUE
+        job["erreur"] = str(e) or e.__class__.__name__
+    finally:
+        email_courant.reset(jeton)
+        if jeton_trace is not None:
+            job["trace"] = metriques.terminer_trace(jeton_trace)
+        _sauver(job)
+        if job["statut"] in (TERMINE, ECHOUE):
+            publier(job["id"], {"type": "fin", "statut": job["statut"], "erreur": job["erreur"]})
+
+
+async def _worker():
+    while True:
+        job_id = await _file.get()
+        try:
+            await _executer(_jobs[job_id])
+        finally:
+            _file.task_done()
+            _jobs.pop(job_id, None)  # la version sur disque fait foi une fois le job fini
+
+
+def _recuperer():
+    # Au démarrage : relance les jobs interrompus (tant qu'il reste des tentatives), purge les vieux
+    if not os.path.isdir(JOBS_DIR):
+        return
+    maintenant = time.time()
+    for nom in sorted(os.listdir(JOBS_DIR)):
+        if not nom.endswith(".json"):
+            continue
+        job = lire(nom[:-5])
+        if job is None:
+            continue
+        if job["statut"] in (TERMINE, ECHOUE):
+            if maintenant - job.get("maj", 0) > CONSERVATION:
+                os.remove(_chemin(job["id"]))
+            continue
+        _jobs[job["id"]] = job
+        if job["tentatives"] >= TENTATIVES_MAX or _file.full() or job["type"] not in _handlers:
+            job["statut"] = ECHOUE
+            job["erreur"] = "Interrompu par un redémarrage du serveur"
+        else:
+            job["statut"] = EN_ATTENTE
+            _file.put_nowait(job["id"])
+        _sauver(job)
+
+
+async def demarrer():
+    global _file
+    _file = asyncio.Queue(maxsize=FILE_MAX)
+    _recuperer()
+    for _ in range(NB_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def arreter():
+    # Les jobs en cours restent "en_cours" sur disque et seront repris au prochain démarrage
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import random
+import asyncio
+import httpx
+from dotenv import load_dotenv
+from backend.cache import cache_llm, calculer_cle, CACHE_ACTIF
+from backend import modeles, metriques
+
+load_dotenv()
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "Content-Type": "application/json"
+}
+# surchargeable pour viser un faux serveur (bench/mock_openrouter.py)
+CLAUDE_URL = os.getenv("CLAUDE_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Réglages du client (surchargeables par variables d'environnement)
+DELAI_APPEL = float(os.getenv("LLM_DELAI", "60"))  # deadline totale d'un appel, retries compris (s)
+DELAI_CONNEXION = float(os.getenv("LLM_DELAI_CONNEXION", "10"))
+TENTATIVES_MAX = max(1, int(os.getenv("LLM_TENTATIVES", "3")))
+BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "8"))
+HEDGE_DELAI = float(os.getenv("LLM_HEDGE_DELAI", "0"))  # 0 = pas de requête doublée
+MAX_CONNEXIONS = int(os.getenv("LLM_MAX_CONNEXIONS", "20"))
+DISJONCTEUR_SEUIL = int(os.getenv("LLM_DISJONCTEUR_SEUIL", "5"))
+DISJONCTEUR_PAUSE = float(os.getenv("LLM_DISJONCTEUR_PAUSE", "30"))
+
+
+class ErreurIA(Exception):
+    pass
+
+
+class ErreurTransitoire(ErreurIA):
+    # 429 / 5xx / réseau : ça vaut le coup de réessayer
+    pass
+
+
+class CircuitOuvert(ErreurIA):
+    pass
+
+
+class Disjoncteur:
+    # Après `seuil` échecs consécutifs on coupe les appels pendant `pause` secondes.
+    # Passé ce délai on laisse repasser les appels : un succès referme, un échec rouvre.
+    def __init__(self, seuil: int, pause: float):
+        self.seuil = seuil
+        self.pause = pause
+        self.echecs = 0
+        self.ouvert_jusqua = 0.0
+
+    def autoriser(self) -> bool:
+        return time.monotonic() >= self.ouvert_jusqua
+
+    def succes(self):
+        self.echecs = 0
+        self.ouvert_jusqua = 0.0
+
+    def echec(self):
+        self.echecs += 1
+        if self.echecs >= self.seuil:
+            self.ouvert_jusqua = time.monotonic() + self.pause
+
+
+# un disjoncteur par modèle : un modèle en panne ne bloque pas ses modèles de secours
+_disjoncteurs = {}
+_client = None
+# limiteur global optionnel (traitements par lot) : `await attendre()` avant chaque requête HTTP,
+# `consommer(usage)` après chaque réponse
+_limiteur = None
+
+
+def definir_limiteur(limiteur):
+    global _limiteur
+    _limiteur = limiteur
+
+
+def get_disjoncteur(modele: str) -> Disjoncteur:
+    if modele not in _disjoncteurs:
+        _disjoncteurs[modele] = Disjoncteur(DISJONCTEUR_SEUIL, DISJONCTEUR_PAUSE)
+    return _disjoncteurs[modele]
+
+
+def get_client() -> httpx.AsyncClient:
+    # Client partagé : connexions keep-alive réutilisées (pas de handshake TLS à chaque appel)
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            headers=HEADERS,
+            timeout=httpx.Timeout(DELAI_APPEL, connect=DELAI_CONNEXION),
+            limits=httpx.Limits(max_connections=MAX_CONNEXIONS, max_keepalive_connections=MAX_CONNEXIONS),
+        )
+    return _client
+
+
+async def fermer_client():
+    global _client
+    await cache_llm.terminer_ecritures()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _poster(data: dict) -> dict:
+    try:
+        response = await get_client().post(CLAUDE_URL, json=data)
+    except httpx.TransportError as e:
+        raise ErreurTransitoire(str(e)) from e
+    if response.status_code == 429 or response.status_code >= 500:
+        raise ErreurTransitoire(f"HTTP {response.status_code}")
+    if response.status_code >= 400:
+        raise ErreurIA(f"HTTP {response.status_code} : {response.text[:200]}")
+    return response.json()
+
+
+async def _poster_avec_hedge(data: dict, hedge: float) -> dict:
+    # Si la première requête n'a pas répondu après `hedge` secondes, on en lance une
+    # deuxième identique et on garde la première réponse valide.
+    if hedge <= 0:
+        return await _poster(data)
+
+    premiere = asyncio.create_task(_poster(data))
+    termine, _ = await asyncio.wait({premiere}, timeout=hedge)
+    if termine:
+        return premiere.result()
+
+    en_cours = {premiere, asyncio.create_task(_poster(data))}
+    erreur = None
+    try:
+        while en_cours:
+            termine, en_cours = await asyncio.wait(en_cours, return_when=asyncio.FIRST_COMPLETED)
+            for tache in termine:
+                if tache.exception() is None:
+                    return tache.result()
+                erreur = tache.exception()
+        raise erreur
+    finally:
+        for tache in en_cours:
+            tache.cancel()
+
+
+async def _completer(data: dict, hedge: float):
+    # -> (texte, usage) ; usage = compte de tokens renvoyé par OpenRouter (peut manquer)
+    disjoncteur = get_disjoncteur(data["model"])
+    for tentative in range(TENTATIVES_MAX):
+        if not disjoncteur.autoriser():
+            raise CircuitOuvert("OpenRouter indisponible, appels suspendus")
+        if _limiteur is not None:
+            await _limiteur.attendre()
+        try:
+            reponse = await _poster_avec_hedge(data, hedge)
+        except ErreurTransitoire:
+            disjoncteur.echec()
+            if tentative == TENTATIVES_MAX - 1:
+                raise
+            # backoff exponentiel avec jitter complet
+            await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** tentative)))
+            continue
+        disjoncteur.succes()
+        try:
+            return reponse["choices"][0]["message"]["content"], reponse.get("usage")
+        except (KeyError, IndexError, TypeError) as e:
+            raise ErreurIA(f"Réponse inattendue : {reponse}") from e
+
+
+def _candidats(modele: str, etape: str) -> list:
+    # modèle imposé par l'appelant, sinon les candidats de l'étape (ordonnés par santé)
+    return [modele] if modele else modeles.candidats(etape)
+
+
+async def completer(prompt: str, modele: str = None, etape: str = None, delai: float = None, hedge: float = None, cache: bool = True, **params) -> str:
+    # etape : réglages de backend/modeles.py (modèles candidats, max_tokens, temperature), avec bascule
+    # sur le candidat suivant en cas d'erreur ou de délai dépassé.
+    # cache=False : on ne lit pas le cache (ex. "régénérer" explicite) mais on y range la nouvelle réponse
+    params = {**modeles.parametres(etape), **params}
+    essais = []
+    for candidat in _candidats(modele, etape):
+        data = {"model": candidat, "messages": [{"role": "user", "content": prompt}], **params}
+        essais.append((data, calculer_cle(data)))
+    if cache and CACHE_ACTIF:
+        for data, cle in essais:
+            contenu = await cache_llm.lire_async(cle)
+            if contenu is not None:
+                metriques.observer_llm(etape, data["model"], "cache")
+                return contenu
+
+    erreur = None
+    for data, cle in essais:
+        if erreur is not None:
+            metriques.llm_bascules.inc(etape=etape or "autre", modele=data["model"])
+        if not get_disjoncteur(data["model"]).autoriser():
+            erreur = CircuitOuvert(f"{data['model']} indisponible, appels suspendus")
+            metriques.observer_llm(etape, data["model"], "circuit_ouvert")
+            continue
+        debut = time.perf_counter()
+        try:
+            contenu, usage = await asyncio.wait_for(
+                _completer(data, HEDGE_DELAI if hedge is None else hedge),
+                timeout=DELAI_APPEL if delai is None else delai,
+            )
+        except (asyncio.TimeoutError, ErreurIA) as e:
+            modeles.enregistrer(data["model"], debut, False)
+            metriques.observer_llm(etape, data["model"], "delai" if isinstance(e, asyncio.TimeoutError) else "erreur", time.perf_counter() - debut)
+            metriques.ajouter_span("llm", debut, time.perf_counter(), etape=etape, modele=data["model"], jour=metriques.jour_courant.get(), erreur=e.__class__.__name__)
+            erreur = e if isinstance(e, ErreurIA) else ErreurIA(f"Délai dépassé ({data['model']})")
+            continue
+        modeles.enregistrer(data["model"], debut, True)
+        metriques.observer_llm(etape, data["model"], "ok", time.perf_counter() - debut, usage)
+        metriques.ajouter_span("llm", debut, time.perf_counter(), etape=etape, modele=data["model"], jour=metriques.jour_courant.get())
+        if _limiteur is not None:
+            _limiteur.consommer(usage)
+        if CACHE_ACTIF:
+            cache_llm.ecrire(cle, contenu)
+        return contenu
+    raise erreur
+
+
+async def _flux(data: dict, usage: dict, fin: float):
+    # Une tentative de stream. `fin` : heure limite (horloge de la boucle) pour tout l'appel ; les keep-alive
+    # ": OPENROUTER PROCESSING" relancent le timeout de lecture d'httpx, pas celle-ci.
+    # Le timeout n'entoure jamais le `yield` : il ne doit pas annuler le code de l'appelant.
+    client = get_client()
+    try:
+        async with asyncio.timeout_at(fin):
+            response = await client.send(client.build_request("POST", CLAUDE_URL, json=data), stream=True)
+        try:
+            if response.status_code == 429 or response.status_code >= 500:
+                raise ErreurTransitoire(f"HTTP {response.status_code}")
+            if response.status_code >= 400:
+                raise ErreurIA(f"HTTP {response.status_code}")
+            lignes = response.aiter_lines()
+            while True:
+                async with asyncio.timeout_at(fin):
+                    try:
+                        ligne = await anext(lignes)
+                    except StopAsyncIteration:
+                        break
+                # les lignes ": ..." sont des commentaires keep-alive
+                if not ligne.startswith("data:"):
+                    continue
+                contenu = ligne[len("data:"):].strip()
+                if contenu == "[DONE]":
+                    break
+                try:
+                    paquet = json.loads(contenu)
+                    if isinstance(paquet.get("usage"), dict):
+                        usage.update(paquet["usage"])
+                    morceau = paquet["choices"][0]["delta"].get("content")
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    continue
+                if morceau:
+                    yield morceau
+        finally:
+            await response.aclose()
+    except httpx.TransportError as e:
+        raise ErreurTransitoire(str(e)) from e
+
+
+async def _streamer(data: dict, usage: dict, fin: float):
+    # Mêmes garanties que _completer tant que rien n'est parti : retries avec backoff sur 429 / 5xx / réseau,
+    # disjoncteur et limiteur à chaque tentative. Après le premier morceau on ne peut plus recommencer.
+    # `usage` est rempli avec le compte de tokens si OpenRouter l'envoie dans le dernier morceau
+    disjoncteur = get_disjoncteur(data["model"])
+    for tentative in range(TENTATIVES_MAX):
+        if not disjoncteur.autoriser():
+            raise CircuitOuvert(f"{data['model']} indisponible, appels suspendus")
+        if _limiteur is not None:
+            await _limiteur.attendre()
+        envoye = False
+        try:
+            async for morceau in _flux(data, usage, fin):
+                envoye = True
+                yield morceau
+        except ErreurTransitoire:
+            disjoncteur.echec()
+            if envoye or tentative == TENTATIVES_MAX - 1:
+                raise
+            # backoff exponentiel avec jitter complet, sans dépasser la deadline
+            async with asyncio.timeout_at(fin):
+                await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** tentative)))
+            continue
+        disjoncteur.succes()
+        return
+
+
+async def streamer(prompt: str, modele: str = None, etape: str = None, delai: float = None, cache: bool = True, **params):
+    # Générateur asynchrone des morceaux de texte au fil de l'eau (OpenRouter `stream=True`, format SSE).
+    # Retries et bascule sur le modèle suivant seulement tant que rien n'a été envoyé ; chaque modèle
+    # a sa deadline totale (DELAI_APPEL), comme dans completer.
+    params = {**modeles.parametres(etape), **params}
+    essais = []
+    for candidat in _candidats(modele, etape):
+        data = {"model": candidat, "messages": [{"role": "user", "content": prompt}], "stream": True, **params}
+        essais.append((data, calculer_cle(data)))
+    if cache and CACHE_ACTIF:
+        for data, cle in essais:
+            contenu = await cache_llm.lire_async(cle)
+            if contenu is not None:
+                metriques.observer_llm(etape, data["model"], "cache")
+                yield contenu
+                return
+
+    erreur = None
+    for data, cle in essais:
+        if erreur is not None:
+            metriques.llm_bascules.inc(etape=etape or "autre", modele=data["model"])
+        morceaux = []
+        usage = {}
+        debut = time.perf_counter()
+        fin = asyncio.get_running_loop().time() + (DELAI_APPEL if delai is None else delai)
+        try:
+            async for morceau in _streamer(data, usage, fin):
+                morceaux.append(morceau)
+                yield morceau
+        except (asyncio.TimeoutError, ErreurIA) as e:
+            modeles.enregistrer(data["model"], debut, False)
+            metriques.observer_llm(etape, data["model"], "delai" if isinstance(e, asyncio.TimeoutError) else "erreur", time.perf_counter() - debut)
+            metriques.ajouter_span("llm", debut, time.perf_counter(), etape=etape, modele=data["model"], jour=metriques.jour_courant.get(), erreur=e.__class__.__name__)
+            erreur = e if isinstance(e, ErreurIA) else ErreurIA(f"Délai dépassé ({data['model']})")
+            if morceaux:
+                if erreur is e:
+                    raise
+                raise erreur from e
+            continue
+        modeles.enregistrer(data["model"], debut, True)
+        metriques.observer_llm(etape, data["model"], "ok", time.perf_counter() - debut, usage)
+        metriques.ajouter_span("llm", debut, time.perf_counter(), etape=etape, modele=data["model"], jour=metriques.jour_courant.get(), stream=True)
+        if _limiteur is not None:
+            _limiteur.consommer(usage)
+        if CACHE_ACTIF and morceaux:
+            cache_llm.ecrire(cle, "".join(morceaux))
+        return
+    raise erreur
@@ -1,27 +1,329 @@
 import os
 import json
+import time
+import asyncio
+import logging
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
-import requests
-from backend.utils import user_file_path 
+from backend.utils import get_user_email, lire_document, ecrire_document, modifier_document, JOURS
+from backend.llm import completer, streamer, fermer_client
+from backend.pipeline import Etape, executer
+from backend import jobs
+from backend.cache import cache_llm
+from backend import semaine, courses, storage, routage, edition, modeles, metriques, concurrence, statique, pages, bibliotheque
 from typing import List # 👈 ajout unique
 
 load_dotenv()
 
 app = FastAPI()
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", statique.StatiqueImmuable(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = statique.static_url
+logger = logging.getLogger("monprojetia.http")
+
+# Nombre max d'appels IA lancés en même temps pour les 7 jours (1 = ancien mode séquentiel)
+MAX_APPELS_PARALLELES = max(1, int(os.getenv("MAX_APPELS_PARALLELES", "7")))
+# "jour" : un appel IA par jour ; "semaine" : un seul appel JSON pour la semaine, puis appel par jour
+# uniquement pour les jours invalides
+MODE_GENERATION = os.getenv("MODE_GENERATION", "jour")
+# "locale" : liste de courses additionnée sans IA (incrémentale) ; "ia" : ancienne liste rédigée par l'IA
+MODE_LISTE = os.getenv("MODE_LISTE", "locale")
+# "patch" : le coach modifie seulement les lignes concernées ; "complet" : régénère les jours / le training
+MODE_EDITION = os.getenv("MODE_EDITION", "patch")
+# ajouté aux prompts des jours pour que les quantités soient faciles à relire
+FORMAT_ALIMENTS = " Écris un aliment par ligne au format '- aliment : quantité g' (ou 'ml', ou un nombre de pièces)."
+ETAPES_SEMAINE = (["semaine"] if MODE_GENERATION == "semaine" else []) + JOURS + ["training", "liste"]
+# Envoi du texte au navigateur au fil de l'eau (SSE) pendant les générations
+STREAMING = os.getenv("STREAMING", "1") == "1"
+ENTETES_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+TROP_DE_DEMANDES = "Trop de générations en cours, réessaie dans quelques instants 🙏"
+
+
+_surveillance = []
+
+
+@app.on_event("startup")
+async def demarrage():
+    storage.migrer_si_necessaire()
+    await jobs.demarrer()
+    _surveillance.append(asyncio.create_task(metriques.surveiller_boucle()))
+
+
+@app.on_event("shutdown")
+async def arret():
+    for tache in _surveillance:
+        tache.cancel()
+    await jobs.arreter()
+    await fermer_client()
+
+
+@app.middleware("http")
+async def mesurer(request: Request, call_next):
+    # Durée et statut de chaque requête (routes de main.py et de router.py).
+    # Avec l'en-tête "X-Trace: 1" (ou TRACE=1), les étapes sont chronométrées : en-tête Server-Timing + log.
+    # Pour les réponses en streaming, la durée s'arrête à l'envoi des en-têtes.
+    debut = time.perf_counter()
+    jeton = metriques.demarrer_trace() if metriques.doit_tracer(request.headers.get("x-trace")) else None
+    statut = 500
+    try:
+        response = await call_next(request)
+        statut = response.status_code
+    finally:
+        route = request.scope.get("route")
+        chemin = getattr(route, "path", "non_trouvee")  # gabarit de la route ("/regenerer/{jour}") : pas d'explosion des étiquettes
+        duree = time.perf_counter() - debut
+        metriques.http_requetes.inc(methode=request.method, route=chemin, statut=statut)
+        metriques.http_duree.observer(duree, methode=request.method, route=chemin)
+        spans = metriques.terminer_trace(jeton) if jeton is not None else None
+    if spans is not None:
+        spans.insert(0, {"nom": "requete", "debut_ms": 0.0, "duree_ms": round(duree * 1000, 1), "route": chemin})
+        response.headers["Server-Timing"] = metriques.server_timing(spans)
+        logger.info("trace %s %s %s", request.method, chemin, json.dumps(spans, ensure_ascii=False))
+    return response
+
+
+@app.get("/metrics")
+async def exposer_metriques():
+    return PlainTextResponse(metriques.exposer(), media_type="text/plain; version=0.0.4")
+
+
+def format_sse(evenement: dict) -> str:
+    return f"data: {json.dumps(evenement, ensure_ascii=False)}\n\n"
+
+
+async def generer_un_jour(jour: str, prompt: str, semaphore: asyncio.Semaphore, secours: dict = None, sur_texte=None) -> str:
+    # Un jour en erreur n'impacte pas les autres : on garde `secours[jour]` ou le message d'erreur.
+    metriques.jour_courant.set(jour)
+    async with semaphore:
+        try:
+            if sur_texte is not None and STREAMING:
+                morceaux = []
+                async for morceau in streamer(prompt, etape="jour"):
+                    morceaux.append(morceau)
+                    sur_texte(jour, morceau)
+                return "".join(morceaux)
+            return await completer(prompt, etape="jour")
+        except Exception as e:
+            metriques.compter_secours("jour", e)
+            return (secours or {}).get(jour, f"Erreur IA pour {jour}")
+
+
+async def generer_jours(prompts: dict, secours: dict = None) -> dict:
+    # Lance les prompts {jour: prompt} en parallèle (plafonné par MAX_APPELS_PARALLELES).
+    semaphore = asyncio.Semaphore(MAX_APPELS_PARALLELES)
+    resultats = await asyncio.gather(*(generer_un_jour(jour, prompt, semaphore, secours) for jour, prompt in prompts.items()))
+    return dict(zip(prompts.keys(), resultats))
+
+
+async def editer_un_jour(jour: str, texte: str, instruction: str, contexte: str, prompt: str, semaphore: asyncio.Semaphore, secours: dict = None) -> str:
+    # Patch minimal du jour existant ; si l'IA renvoie un patch inapplicable on régénère le jour en entier
+    metriques.jour_courant.set(jour)
+    async with semaphore:
+        try:
+            return await edition.editer(texte, instruction, contexte)
+        except Exception as e:
+            metriques.compter_secours("edition", e)
+    return await generer_un_jour(jour, prompt, semaphore, secours)
+
+
+async def editer_jours(plannings: dict, prompts: dict, instruction: str, contexte: str = "", secours: dict = None) -> dict:
+    # Comme generer_jours, mais en mode patch sur les plannings existants
+    semaphore = asyncio.Semaphore(MAX_APPELS_PARALLELES)
+    taches = []
+    for jour, prompt in prompts.items():
+        if plannings.get(jour):
+            taches.append(editer_un_jour(jour, plannings[jour], instruction, contexte, prompt, semaphore, secours))
+        else:
+            taches.append(generer_un_jour(jour, prompt, semaphore, secours))
+    resultats = await asyncio.gather(*taches)
+    return dict(zip(prompts.keys(), resultats))
+
+
+def prompts_generer(formulaire: dict) -> dict:
+    prompts = {}
+    for jour in JOURS:
+        prompts[jour] = (
+            f"Tu es un expert en nutrition. Génére un planning pour le {jour} : "
+            f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
+            f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
+            f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, budget hebdo : {formulaire['budget']}€. "
+            f"L’utilisateur a précisé : {formulaire['precision']}. "
+            f"Adapte les repas pour respecter le régime et éviter les allergènes. "
+            f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
+            f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
+            f"le budget est primordial, prens bien en compte {formulaire['budget']} et assure toi que ce qui est dépensé dans la semaine en nourriture ne dépasse en aucun cas ce montant en euros, base toi sur le prix moyen des aliments en france en euros"
+            + FORMAT_ALIMENTS
+        )
+    return prompts
+
+
+def prompts_remarque(formulaire: dict, feedback: str) -> dict:
+    prompts = {}
+    for jour in JOURS:
+        prompts[jour] = (
+            f"Tu es un expert en nutrition. Génére un planning pour le {jour} : "
+            f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
+            f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
+            f"objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
+            f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, budget hebdo : {formulaire['budget']}€. "
+            f"L’utilisateur a précisé : {formulaire['precision']}. "
+            f"Remarque de l’utilisateur cette semaine : {feedback}. "
+            f"Adapte les repas pour respecter le régime et éviter les allergènes. "
+            f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
+            f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
+            + FORMAT_ALIMENTS
+        )
+    return prompts
+
+
+def prompt_regenerer(formulaire: dict, jour: str) -> str:
+    return (
+        f"Tu es un expert en nutrition. Génére uniquement le planning pour le {jour} : "
+        f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
+        f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
+        f"objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
+        f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, "
+        f"budget hebdo : {formulaire['budget']}€. "
+        f"L’utilisateur a précisé : {formulaire['precision']}. "
+        f"Adapte les repas pour respecter le régime et éviter les allergènes. "
+        f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
+        f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
+        f"le budget est primordial, prens bien en compte {formulaire['budget']}€ et assure toi que ce qui est dépensé  en nourriture ne dépasse en aucun cas ce montant en euros, base toi sur le prix moyen des aliments en france en euros"
+        + FORMAT_ALIMENTS
+    )
+
+
+async def generer_semaine(prompts: dict, formulaire: dict, sur_etape=None, deja_faits: dict = None, sur_texte=None, prompt_semaine: str = None) -> dict:
+    # Étapes : les 7 jours et le training démarrent tout de suite (le training ne dépend
+    # pas des repas), la liste de courses part dès que le dernier jour est arrivé.
+    # En MODE_GENERATION "semaine" (avec `prompt_semaine`), une étape "semaine" fait un seul appel JSON
+    # et chaque jour ne repasse par son prompt individuel que s'il est invalide.
+    # `deja_faits` : étapes déjà faites lors d'une exécution interrompue (reprise d'un job).
+    # `sur_texte(jour, morceau)` : reçoit le texte des jours au fil de l'eau.
+    semaphore = asyncio.Semaphore(MAX_APPELS_PARALLELES)
+    deja_faits = deja_faits or {}
+    mode_semaine = MODE_GENERATION == "semaine" and prompt_semaine is not None
+    structure = {}
+
+    async def etape_semaine(_):
+        if "semaine" in deja_faits:
+            return deja_faits["semaine"]
+        try:
+            return await completer(prompt_semaine, etape="semaine")
+        except Exception as e:
+            metriques.compter_secours("semaine", e)
+            return ""  # tous les jours repasseront en appel individuel
+
+    def etape_jour(jour):
+        async def lancer(entrees):
+            if mode_semaine:
+                repas = semaine.valider_semaine(entrees["semaine"]).get(jour)
+                if repas is not None:
+                    structure[jour] = repas
+                    return semaine.rendre_jour(repas)
+            if jour in deja_faits:
+                return deja_faits[jour]
+            return await generer_un_jour(jour, prompts[jour], semaphore, sur_texte=sur_texte)
+        return Etape(jour, lancer, dependances=["semaine"] if mode_semaine else [])
+
+    async def etape_liste(jours):
+        plannings = {jour: jours[jour] for jour in JOURS}
+        data_json = {"plannings": plannings}
+        if structure:
+            data_json["structure"] = structure
+        # planning + liste écrits ensemble : une régénération ou une modif du coach attend son tour
+        async with concurrence.verrou(get_user_email()):
+            ecrire_document("planning", data_json)
+            await generer_liste_courses(plannings, structure)
+
+    async def etape_training(_):
+        await generer_training(
+            formulaire["objectif"],
+            formulaire["activite"],
+            formulaire["sport_actuel"],
+            formulaire["sport_passe"],
+            formulaire["temps_dispo"],
+            formulaire.get("jours_sport", []),
+        )
+
+    etapes = [etape_jour(jour) for jour in JOURS]
+    if mode_semaine:
+        etapes.append(Etape("semaine", etape_semaine))
+    etapes.append(Etape("training", etape_training))
+    etapes.append(Etape("liste", etape_liste, dependances=JOURS))
+    resultats, durees = await executer(etapes, nom="generation semaine", sur_etape=sur_etape)
+    for etape in ("liste", "training"):
+        if isinstance(resultats[etape], Exception):
+            raise resultats[etape]
+    return durees
+
+
+async def job_semaine(job: dict, progression):
+    formulaire = lire_document("formulaire")
+    if job["type"] == "remarque":
+        prompts = prompts_remarque(formulaire, job["entree"]["feedback"])
+        prompt_semaine = semaine.prompt_semaine(formulaire, job["entree"]["feedback"])
+    else:
+        prompts = prompts_generer(formulaire)
+        prompt_semaine = semaine.prompt_semaine(formulaire)
+
+    def sur_texte(jour, morceau):
+        jobs.publier(job["id"], {"type": "texte", "etape": jour, "texte": morceau})
+
+    await generer_semaine(
+        prompts, formulaire,
+        sur_etape=progression, deja_faits=job["resultats"], sur_texte=sur_texte, prompt_semaine=prompt_semaine,
+    )
+
+    if job["type"] == "generer":
+        # semaine sans remarque : réutilisable pour les prochains profils proches
+        try:
+            bibliotheque.ajouter(formulaire, lire_document("planning"), lire_document("liste"), lire_document("training"))
+        except Exception as e:
+            metriques.compter_secours("bibliotheque", e)
+
+
+async def job_regenerer(job: dict, progression):
+    jour = job["entree"]["jour"]
+    jeton = metriques.jour_courant.set(jour)  # remis à zéro à la fin : le worker enchaîne d'autres jobs
+    try:
+        await _regenerer(job, jour, progression)
+    finally:
+        metriques.jour_courant.reset(jeton)
+
+
+async def _regenerer(job: dict, jour: str, progression):
+    formulaire = lire_document("formulaire")
+
+    progression(jour, jobs.EN_COURS)
+    # régénération explicite : on veut une nouvelle version, pas la réponse en cache
+    contenu = await completer_ou_streamer(
+        prompt_regenerer(formulaire, jour),
+        lambda morceau: jobs.publier(job["id"], {"type": "texte", "etape": jour, "texte": morceau}),
+        cache=False,
+        etape="jour",
+    )
+
+    def maj(data_json):
+        data_json["plannings"][jour] = contenu
+        data_json.get("structure", {}).pop(jour, None)  # la version JSON de ce jour n'est plus à jour
+        return data_json
+
+    async with concurrence.verrou(get_user_email()):
+        data_json = modifier_document("planning", maj)
+        progression(jour, jobs.TERMINE, contenu)
+
+        progression("liste", jobs.EN_COURS)
+        await generer_liste_courses(data_json["plannings"], data_json.get("structure"), jours_modifies=[jour])
+    progression("liste", jobs.TERMINE)
+
+
+jobs.enregistrer("generer", job_semaine)
+jobs.enregistrer("remarque", job_semaine)
+jobs.enregistrer("regenerer", job_regenerer)
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-HEADERS = {
-    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-    "Content-Type": "application/json"
-}
-CLAUDE_URL = "https://openrouter.ai/api/v1/chat/completions"
-JOURS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
 
 @app.get("/accueil", response_class=HTMLResponse)
 async def dashboard(request: Request):
@@ -33,30 +335,100 @@ async def formulaire(request: Request):
 
 @app.get("/planning", response_class=HTMLResponse)
 async def afficher_planning(request: Request):
-    try:
-        with open(user_file_path("planning.json"), "r", encoding="utf-8") as f:
-            plannings = json.load(f)["plannings"]
-    except:
-        plannings = {}
-    return templates.TemplateResponse("planning.html", {"request": request, "plannings": plannings})
+    job_id = request.query_params.get("job")
+    if job_id and jobs.lire(job_id) is None:
+        job_id = None
+
+    def contexte():
+        try:
+            plannings = lire_document("planning")["plannings"]
+        except:
+            plannings = {}
+        return {"plannings": plannings, "job_id": job_id, "jours": JOURS}
+
+    if job_id:
+        # suivi d'une génération en cours : page vivante, pas de cache
+        return templates.TemplateResponse("planning.html", {"request": request, **contexte()})
+    email = get_user_email()
+    return pages.rendre(request, templates, "planning.html", email, storage.etat("planning", email), contexte)
+
+@app.get("/jobs/{job_id}")
+async def statut_job(job_id: str):
+    job = jobs.lire(job_id)
+    if job is None or job["email"] != get_user_email():
+        return JSONResponse({"erreur": "Job introuvable"}, status_code=404)
+    return {
+        "id": job["id"],
+        "type": job["type"],
+        "statut": job["statut"],
+        "etapes": job["etapes"],
+        "erreur": job["erreur"],
+    }
+
+@app.get("/jobs/{job_id}/flux")
+async def flux_job(job_id: str):
+    # Progression + texte des jours en Server-Sent Events
+    job = jobs.lire(job_id)
+    if job is None or job["email"] != get_user_email():
+        return JSONResponse({"erreur": "Job introuvable"}, status_code=404)
+
+    async def evenements():
+        file = jobs.abonner(job_id)
+        try:
+            # état actuel d'abord : un navigateur qui se connecte en retard récupère les jours déjà prêts
+            etat = jobs.lire(job_id) or job
+            yield format_sse({"type": "etat", "statut": etat["statut"], "etapes": etat["etapes"], "resultats": etat["resultats"], "erreur": etat["erreur"]})
+            if etat["statut"] in (jobs.TERMINE, jobs.ECHOUE):
+                return
+            while True:
+                try:
+                    evenement = await asyncio.wait_for(file.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(evenement)
+                if evenement["type"] == "fin":
+                    return
+        finally:
+            jobs.desabonner(job_id, file)
+
+    return StreamingResponse(evenements(), media_type="text/event-stream", headers=ENTETES_SSE)
+
+@app.get("/cache/stats")
+async def stats_cache():
+    return cache_llm.stats()
+
+@app.get("/modeles/stats")
+async def stats_modeles():
+    return modeles.stats()
+
+@app.get("/routage/stats")
+async def stats_routage():
+    return routage.stats()
 
 @app.get("/liste", response_class=HTMLResponse)
 async def afficher_liste(request: Request):
-    try:
-        with open(user_file_path("liste.json"), "r", encoding="utf-8") as f:
-            liste = json.load(f)["liste"]
-    except:
-        liste = "Rendez vous d'abord à l'étape 1 😉"
-    return templates.TemplateResponse("liste.html", {"request": request, "liste": liste})
+    def contexte():
+        try:
+            liste = lire_document("liste")["liste"]
+        except:
+            liste = "Rendez vous d'abord à l'étape 1 😉"
+        return {"liste": liste}
+
+    email = get_user_email()
+    return pages.rendre(request, templates, "liste.html", email, storage.etat("liste", email), contexte)
 
 @app.get("/training", response_class=HTMLResponse)
 async def afficher_training(request: Request):
-    try:
-        with open(user_file_path("training.json"), "r", encoding="utf-8") as f:
-            training = json.load(f)["training"]
-    except:
-        training = "Rendez vous d'abord à l'étape 1 😉"
-    return templates.TemplateResponse("training.html", {"request": request, "training": training})
+    def contexte():
+        try:
+            training = lire_document("training")["training"]
+        except:
+            training = "Rendez vous d'abord à l'étape 1 😉"
+        return {"training": training}
+
+    email = get_user_email()
+    return pages.rendre(request, templates, "training.html", email, storage.etat("training", email), contexte)
 
 @app.post("/generer", response_class=HTMLResponse)
 async def generer(
@@ -99,57 +471,66 @@ async def generer(
         "precision": precision,
         "jours_sport": jours_sport  # 👈 AJOUT UNIQUE
     } 
-    os.makedirs("backend/data", exist_ok=True)  # 👈 à ajouter ici
-
-    with open(user_file_path("formulaire.json"), "w", encoding="utf-8") as f:
-        json.dump(formulaire, f, ensure_ascii=False, indent=2)
-
-    plannings = {}
-    for jour in JOURS:
-        prompt = (
-            f"Tu es un expert en nutrition. Génére un planning pour le {jour} : "
-            f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
-            f"{age} ans, {poids} kg, {taille} cm, sexe {sexe}, objectif {objectif}, activité {activite}, "
-            f"régime alimentaire : {regime}, allergies : {allergies}, budget hebdo : {budget}€. "
-            f"L’utilisateur a précisé : {precision}. "
-            f"Adapte les repas pour respecter le régime et éviter les allergènes. "
-            f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
-            f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
-            f"le budget est primordial, prens bien en compte {budget} et assure toi que ce qui est dépensé dans la semaine en nourriture ne dépasse en aucun cas ce montant en euros, base toi sur le prix moyen des aliments en france en euros"
-        )
-        data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-        try:
-            response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-            contenu = response.json()["choices"][0]["message"]["content"]
-            plannings[jour] = contenu
-        except:
-            plannings[jour] = f"Erreur IA pour {jour}"
-
-    with open(user_file_path("planning.json"), "w", encoding="utf-8") as f:
-        json.dump({"plannings": plannings}, f, ensure_ascii=False, indent=2)
-
-    await generer_liste_courses(plannings)
-    await generer_training(objectif, activite, sport_actuel, sport_passe, temps_dispo, jours_sport)
-
-    return RedirectResponse(url="/planning", status_code=303)
+    ecrire_document("formulaire", formulaire)
+    email = get_user_email()
+
+    # ⚡ premier planning seulement : un profil proche d'un profil déjà généré reçoit sa semaine tout de suite,
+    # la génération personnalisée ci-dessous la remplace ensuite. Un utilisateur qui a déjà sa semaine
+    # (modifiée par le coach, etc.) la garde jusqu'à la fin de sa propre génération.
+    servi = False
+    if storage.etat("planning", email) is None and jobs.en_vol("generer", email, {}, cle=formulaire) is None:
+        modele = bibliotheque.chercher(formulaire)
+        if modele is not None:
+            async with concurrence.verrou(email):
+                try:
+                    # version_attendue=0 : rien n'est écrit si un autre worker a créé la semaine entre-temps
+                    with storage.transaction() as db:
+                        storage.ecrire("planning", modele["planning"], email, db=db, version_attendue=0)
+                        storage.ecrire("liste", modele["liste"], email, db=db, version_attendue=0)
+                        if modele["training"] is not None:
+                            storage.ecrire("training", modele["training"], email, db=db, version_attendue=0)
+                    servi = True
+                except storage.ConflitVersion:
+                    pass
 
+    try:
+        job = jobs.soumettre("generer", email, {}, etapes=ETAPES_SEMAINE, cle=formulaire)
+    except jobs.FileSaturee:
+        if servi:
+            return RedirectResponse(url="/planning", status_code=303)
+        return HTMLResponse(TROP_DE_DEMANDES, status_code=503)
+
+    return RedirectResponse(url=f"/planning?job={job['id']}", status_code=303)
+
+
+async def generer_liste_courses(plannings: dict, structure: dict = None, jours_modifies: list = None):
+    # MODE_LISTE "locale" : les quantités sont additionnées ici, sans appel IA ; si seuls
+    # `jours_modifies` ont changé on met la liste existante à jour au lieu de tout recalculer.
+    if MODE_LISTE == "locale":
+        def maj(ancienne):
+            if jours_modifies is not None and ancienne and "par_jour" in ancienne and "totaux" in ancienne:
+                try:
+                    return courses.remplacer_jours(ancienne, plannings, jours_modifies, structure)
+                except Exception as e:
+                    metriques.compter_secours("liste", e)  # mise à jour incrémentale impossible : on recalcule tout
+            return courses.construire(plannings, structure)
+
+        modifier_document("liste", maj)
+        return
 
-async def generer_liste_courses(plannings: dict):
     texte_complet = "\n".join(plannings.values())
     prompt_liste = (
         "Génère une seule liste de courses pour toute la semaine (sans séparer par jour) avec quantités et grammages précis.Organise la de maniere intelligente pour un max de visibilité en rassemblant les aliments de meme nature (ex: legumes:) "
         "Assure-toi que chaque ingrédient listé est présent avec un grammage total correspondant à l’addition de tous les repas des 7 jours. Aucun ingrédient ne doit être oublié.\n"
         + texte_complet
     )
-    data_courses = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt_liste}]}
     try:
-        response = requests.post(CLAUDE_URL, headers=HEADERS, json=data_courses)
-        liste = response.json()["choices"][0]["message"]["content"]
-    except:
+        liste = await completer(prompt_liste, etape="liste")
+    except Exception as e:
+        metriques.compter_secours("liste", e)
         liste = "Erreur lors de la génération de la liste."
 
-    with open(user_file_path("liste.json"), "w", encoding="utf-8") as f:
-        json.dump({"liste": liste}, f, ensure_ascii=False, indent=2)
+    ecrire_document("liste", {"liste": liste})
 
 
 
@@ -165,15 +546,13 @@ async def generer_training(objectif: str, activite: str, sport_actuel: str, spor
         f"Pour eviter les malentendus, trouve un lien sur le web montrant une animation de l exercice, pour avoir un aperçu visuel, je te laisse la liberté du site du moment que ça marche, mets le lien en cliquable directement "
         f"detaille bien les series et les repetitions si c'est necessaire"
     )
-    data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
     try:
-        response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-        contenu = response.json()["choices"][0]["message"]["content"]
-    except:
+        contenu = await completer(prompt, etape="training")
+    except Exception as e:
+        metriques.compter_secours("training", e)
         contenu = "Erreur génération entraînement."
 
-    with open(user_file_path("training.json"), "w", encoding="utf-8") as f:
-        json.dump({"training": contenu}, f, ensure_ascii=False, indent=2)
+    ecrire_document("training", {"training": contenu})
 
 
 @app.get("/regenerer/{jour}", response_class=HTMLResponse)
@@ -182,45 +561,16 @@ async def regenerer_jour(request: Request, jour: str):
         return RedirectResponse(url="/planning", status_code=303)
 
     try:
-        with open(user_file_path("formulaire.json"), "r", encoding="utf-8") as f:
-            formulaire = json.load(f)
-    except:
+        lire_document("formulaire")  # le job relit le profil ; ici on vérifie seulement qu'il existe
+    except storage.DocumentIntrouvable:
         return RedirectResponse(url="/planning", status_code=303)
 
-    prompt = (
-        f"Tu es un expert en nutrition. Génére uniquement le planning pour le {jour} : "
-        f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
-        f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
-        f"objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
-        f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, "
-        f"budget hebdo : {formulaire['budget']}€. "
-        f"L’utilisateur a précisé : {formulaire['precision']}. "
-        f"Adapte les repas pour respecter le régime et éviter les allergènes. "
-        f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
-        f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
-        f"le budget est primordial, prens bien en compte {formulaire['budget']}€ et assure toi que ce qui est dépensé  en nourriture ne dépasse en aucun cas ce montant en euros, base toi sur le prix moyen des aliments en france en euros"
-    )
-
-    data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-
     try:
-        response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-        contenu = response.json()["choices"][0]["message"]["content"]
-
-        with open(user_file_path("planning.json"), "r", encoding="utf-8") as f:
-            data_json = json.load(f)
-
-        data_json["plannings"][jour] = contenu
-
-        with open(user_file_path("planning.json"), "w", encoding="utf-8") as f:
-            json.dump(data_json, f, ensure_ascii=False, indent=2)
+        job = jobs.soumettre("regenerer", get_user_email(), {"jour": jour}, etapes=[jour, "liste"])
+    except jobs.FileSaturee:
+        return HTMLResponse(TROP_DE_DEMANDES, status_code=503)
 
-        await generer_liste_courses(data_json["plannings"])
-
-    except:
-        pass
-
-    return RedirectResponse(url="/planning", status_code=303)
+    return RedirectResponse(url=f"/planning?job={job['id']}", status_code=303)
 
 
 @app.get("/coach", response_class=HTMLResponse)
@@ -228,49 +578,28 @@ async def coach_page(request: Request):
     return templates.TemplateResponse("coach.html", {"request": request, "reponse": ""})
 
 
-@app.post("/coach", response_class=HTMLResponse)
-@app.post("/coach", response_class=HTMLResponse)
-async def coach_action(request: Request, message: str = Form(...)):
-    message_lower = message.lower()
-    reponse = ""
+async def completer_ou_streamer(prompt: str, sur_texte=None, cache: bool = True, etape: str = "reponse") -> str:
+    # Sans `sur_texte` : appel classique. Avec : on transmet chaque morceau dès réception
+    # et on renvoie le texte complet (pour l'enregistrer ensuite).
+    if sur_texte is None or not STREAMING:
+        contenu = await completer(prompt, etape=etape, cache=cache)
+        if sur_texte is not None:
+            sur_texte(contenu)
+        return contenu
+    morceaux = []
+    async for morceau in streamer(prompt, etape=etape, cache=cache):
+        morceaux.append(morceau)
+        sur_texte(morceau)
+    return "".join(morceaux)
 
-    try:
-        with open(user_file_path("formulaire.json"), "r", encoding="utf-8") as f:
-            formulaire = json.load(f)
-    except:
-        return templates.TemplateResponse("coach.html", {"request": request, "reponse": "Rendez vous d'abord à l'étape 1 😉"})
 
-    
-    prompt_classification = (
-        f"Un utilisateur t’envoie cette requête :\n\n\"{message}\"\n\n"
-        "Ta seule tâche est de dire si cela concerne une demande de modificatiion du planing d'entrainement, une demande de modification du planing de nutrition ou une question n'amenant pas à des modification à laquelle répondre simplement, pour determiner cela ne te base pas sur les mots clés mais reflechis vraiment si l utilisateur cherche une demande de modification ou simplement des infos, par exemple une question de nutrition ou de sport peut etre posée à titre informtif sans attendre de changement dans le planing"
-       
-        "Réponds uniquement par 'modifsport', 'modifnutrition' ou 'nomodif' (sans phrase, sans ponctuation)."
-    )
-    try:
-        data_classification = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt_classification}]}
-        response_class = requests.post(CLAUDE_URL, headers=HEADERS, json=data_classification)
-        domaine = response_class.json()["choices"][0]["message"]["content"].strip().lower()
-    except:
-        domaine = "modifnutrition"
-
-    # 🧠 L’IA détermine les jours concernés
-    prompt_jours = (
-        f"Un utilisateur t’écrit : \"{message}\"\n"
-        f"Quels jours de la semaine sont concernés par sa demande ? "
-        f"Réponds uniquement par une liste de jours clairs en français, séparés par des virgules. "
-        f"Si tous les jours sont concernés, réponds : 'tous'. Aucune autre phrase."
-    )
-    try:
-        data_jours = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt_jours}]}
-        response_jours = requests.post(CLAUDE_URL, headers=HEADERS, json=data_jours)
-        jours_texte = response_jours.json()["choices"][0]["message"]["content"].strip().lower()
-        if "tous" in jours_texte:
-            jours_mentions = JOURS
-        else:
-            jours_mentions = [j for j in JOURS if j.lower() in jours_texte]
-    except:
-        jours_mentions = JOURS
+async def repondre_coach(message: str, formulaire: dict, sur_texte=None) -> str:
+    reponse = ""
+
+    # 🧭 intention + jours concernés en une seule décision (règles locales, sinon un appel IA)
+    decision = await routage.router(message)
+    domaine = decision["intention"]
+    jours_mentions = decision["jours"]
 
     if domaine == "modifsport":
         jours_sport = formulaire.get("jours_sport", [])
@@ -290,21 +619,33 @@ async def coach_action(request: Request, message: str = Form(...)):
             f"Detaille bien les séries et les répétitions si c'est nécessaire."
         )
 
-        data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-        response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-        contenu = response.json()["choices"][0]["message"]["content"]
-
-        with open(user_file_path("training.json"), "w", encoding="utf-8") as f:
-            json.dump({"training": contenu}, f, ensure_ascii=False, indent=2)
+        contenu = None
+        if MODE_EDITION == "patch":
+            try:
+                contenu = await edition.editer(
+                    lire_document("training")["training"], message,
+                    f"C'est un programme d'entraînement pour les jours : {jours_str}. Garde le même format (liens HTML compris).",
+                )
+            except Exception as e:
+                metriques.compter_secours("edition", e)
+                contenu = None  # pas de training existant ou patch inapplicable : on régénère
+            if contenu is not None and sur_texte is not None:
+                sur_texte(f"✅ Programme d'entraînement mis à jour :\n\n{contenu}")
+        if contenu is None:
+            if sur_texte is not None:
+                sur_texte("✅ Nouveau programme d'entraînement généré :\n\n")
+            contenu = await completer_ou_streamer(prompt, sur_texte, etape="training")
+
+        ecrire_document("training", {"training": contenu})
 
         reponse = f"✅ Nouveau programme d'entraînement généré :\n\n{contenu}"
 
     elif domaine == "modifnutrition":
-        with open(user_file_path("planning.json"), "r", encoding="utf-8") as f:
-            data_json = json.load(f)
+        data_json = lire_document("planning")
 
+        prompts = {}
         for jour in jours_mentions:
-            prompt = (
+            prompts[jour] = (
                 f"Tu es un expert en nutrition. Voici une demande utilisateur :\n"
                 f"{message}\n\n"
                 f"Voici son profil : {formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
@@ -313,17 +654,55 @@ async def coach_action(request: Request, message: str = Form(...)):
                 f"budget = {formulaire['budget']}€, précisions : {formulaire['precision']}.\n"
                 f"Génère uniquement les 3 repas (matin, midi, soir) avec aliments et grammages pour le jour : {jour}. "
                 "Aucune introduction, aucun blabla, format brut uniquement."
+                + FORMAT_ALIMENTS
             )
-            data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-            response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-            contenu = response.json()["choices"][0]["message"]["content"]
-            data_json["plannings"][jour] = contenu
-
-        with open(user_file_path("planning.json"), "w", encoding="utf-8") as f:
-            json.dump(data_json, f, ensure_ascii=False, indent=2)
-
-        await generer_liste_courses(data_json["plannings"])
-        reponse = f"✅ Planning nutrition mis à jour."
+        # pas de secours ici : un jour en échec revient en "Erreur IA pour ..." et garde son ancien planning
+        if MODE_EDITION == "patch":
+            contexte = (
+                f"C'est le planning de repas d'une journée. Régime : {formulaire['regime']}, allergies : {formulaire['allergies']}. "
+                "Garde le format '- aliment : quantité g' et des grammages cohérents."
+            )
+            nouveaux = await editer_jours(data_json["plannings"], prompts, message, contexte)
+        else:
+            nouveaux = await generer_jours(prompts)
+        echecs = [jour for jour, contenu in nouveaux.items() if contenu.startswith("Erreur IA pour")]
+        lus = {jour: data_json["plannings"].get(jour) for jour in nouveaux}
+        modifies = [jour for jour, contenu in nouveaux.items() if jour not in echecs and contenu != lus[jour]]
+        ecrits, perimes = [], []
+
+        def maj(data_json):
+            # on ne réécrit que les jours modifiés, et seulement s'ils n'ont pas changé depuis notre lecture
+            # (un /regenerer du même jour terminé entre-temps n'est pas écrasé par un patch de l'ancien texte)
+            ecrits.clear()
+            perimes.clear()
+            for jour in modifies:
+                if data_json["plannings"].get(jour) != lus[jour]:
+                    perimes.append(jour)
+                    continue
+                data_json["plannings"][jour] = nouveaux[jour]
+                data_json.get("structure", {}).pop(jour, None)  # la version JSON de ce jour n'est plus à jour
+                ecrits.append(jour)
+            return data_json
+
+        if modifies:
+            async with concurrence.verrou(get_user_email()):
+                data_json = modifier_document("planning", maj)
+                if ecrits:
+                    await generer_liste_courses(data_json["plannings"], data_json.get("structure"), jours_modifies=ecrits)
+        if ecrits:
+            reponse = f"✅ Planning nutrition mis à jour ({', '.join(ecrits)})."
+        elif echecs:
+            reponse = "❌ Le planning nutrition n'a pas pu être modifié (erreur IA), réessaie dans un instant."
+        elif not perimes:
+            reponse = "Aucun changement à faire : ton planning nutrition reste le même."
+        else:
+            reponse = "⚠️ Planning nutrition non modifié."
+        if echecs and ecrits:
+            reponse += f"\n⚠️ Pas de modification pour {', '.join(echecs)} (erreur IA), réessaie pour ce jour."
+        if perimes:
+            reponse += f"\n⚠️ Non appliqué à {', '.join(perimes)} : ce jour a été modifié entre-temps, renvoie ta demande."
+        if sur_texte is not None:
+            sur_texte(reponse)
 
     else:
         # domaine == "nomodif"
@@ -331,13 +710,61 @@ async def coach_action(request: Request, message: str = Form(...)):
             f"Un utilisateur t’écrit :\n\n{message}\n\n"
             "Réponds de manière pertinente à sa question, avec bienveillance et professionnalisme. Ne dis pas que tu es une IA. Pas de blabla inutile."
         )
-        data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-        response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-        reponse = response.json()["choices"][0]["message"]["content"]
+        reponse = await completer_ou_streamer(prompt, sur_texte)
+
+    return reponse
 
+
+@app.post("/coach", response_class=HTMLResponse)
+@app.post("/coach", response_class=HTMLResponse)
+async def coach_action(request: Request, message: str = Form(...)):
+    try:
+        formulaire = lire_document("formulaire")
+    except:
+        return templates.TemplateResponse("coach.html", {"request": request, "reponse": "Rendez vous d'abord à l'étape 1 😉"})
+
+    # même message déjà en cours de traitement (double envoi) : on attend la même réponse
+    cle = concurrence.empreinte("coach", get_user_email(), message)
+    reponse = await concurrence.unique(cle, lambda: repondre_coach(message, formulaire))
     return templates.TemplateResponse("coach.html", {"request": request, "reponse": reponse})
 
 
+@app.post("/coach/flux")
+async def coach_flux(message: str = Form(...)):
+    # Même traitement que /coach mais la réponse part en Server-Sent Events au fil de l'eau
+    file = asyncio.Queue()
+
+    async def traiter():
+        try:
+            formulaire = lire_document("formulaire")
+        except:
+            await file.put({"type": "fin", "reponse": "Rendez vous d'abord à l'étape 1 😉"})
+            return
+        try:
+            # un doublon en cours ne reçoit que la réponse finale (le texte part vers le premier demandeur)
+            reponse = await concurrence.unique(
+                concurrence.empreinte("coach", get_user_email(), message),
+                lambda: repondre_coach(message, formulaire, sur_texte=lambda morceau: file.put_nowait({"type": "texte", "texte": morceau})),
+            )
+        except Exception as e:
+            metriques.compter_secours("coach", e)
+            reponse = "Erreur IA, réessaie dans quelques instants."
+        await file.put({"type": "fin", "reponse": reponse})
+
+    async def evenements():
+        tache = asyncio.create_task(traiter())
+        try:
+            while True:
+                evenement = await file.get()
+                yield format_sse(evenement)
+                if evenement["type"] == "fin":
+                    return
+        finally:
+            tache.cancel()
+
+    return StreamingResponse(evenements(), media_type="text/event-stream", headers=ENTETES_SSE)
+
+
 @app.get("/remarque", response_class=HTMLResponse)
 async def get_remarque(request: Request):
     return templates.TemplateResponse("remarque.html", {"request": request})
@@ -345,48 +772,16 @@ async def get_remarque(request: Request):
 @app.post("/remarque", response_class=HTMLResponse)
 async def post_remarque(request: Request, feedback: str = Form(...)):
     try:
-        with open(user_file_path("formulaire.json"), "r", encoding="utf-8") as f:
-            formulaire = json.load(f)
+        formulaire = lire_document("formulaire")
     except:
         return templates.TemplateResponse("remarque.html", {"request": request, "erreur": "Rendez vous d'abord à l'étape 1 😉"})
 
-    plannings = {}
-    for jour in JOURS:
-        prompt = (
-            f"Tu es un expert en nutrition. Génére un planning pour le {jour} : "
-            f"3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
-            f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
-            f"objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
-            f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, budget hebdo : {formulaire['budget']}€. "
-            f"L’utilisateur a précisé : {formulaire['precision']}. "
-            f"Remarque de l’utilisateur cette semaine : {feedback}. "
-            f"Adapte les repas pour respecter le régime et éviter les allergènes. "
-            f"N’utilise pas les mots glucides, lipides ou protéines. Format : sans blabla, uniquement les repas."
-            f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia"
-        )
-        data = {"model": "anthropic/claude-3-haiku", "messages": [{"role": "user", "content": prompt}]}
-        try:
-            response = requests.post(CLAUDE_URL, headers=HEADERS, json=data)
-            contenu = response.json()["choices"][0]["message"]["content"]
-            plannings[jour] = contenu
-        except:
-            plannings[jour] = f"Erreur IA pour {jour}"
-
-    with open(user_file_path("planning.json"), "w", encoding="utf-8") as f:
-        json.dump({"plannings": plannings}, f, ensure_ascii=False, indent=2)
-
-    await generer_liste_courses(plannings)
-    await generer_training(
-    formulaire["objectif"],
-    formulaire["activite"],
-    formulaire["sport_actuel"],
-    formulaire["sport_passe"],
-    formulaire["temps_dispo"],
-    formulaire["jours_sport"]
-)
-
+    try:
+        job = jobs.soumettre("remarque", get_user_email(), {"feedback": feedback}, etapes=ETAPES_SEMAINE, cle=[formulaire, feedback])
+    except jobs.FileSaturee:
+        return templates.TemplateResponse("remarque.html", {"request": request, "erreur": TROP_DE_DEMANDES}, status_code=503)
 
-    return RedirectResponse(url="/planning", status_code=303)
+    return RedirectResponse(url=f"/planning?job={job['id']}", status_code=303)
 
 
 from backend import router
@@ -0,0 +1,177 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import contextvars
+
+# Métriques au format texte Prometheus (exposées sur /metrics) + traces optionnelles par requête.
+# Pas de dépendance : compteurs / jauges / histogrammes minimalistes, tout en mémoire du process.
+logger = logging.getLogger("monprojetia.metriques")
+
+TRACE_TOUJOURS = os.getenv("TRACE", "0") == "1"
+TRACE_ECHANTILLON = float(os.getenv("TRACE_ECHANTILLON", "0"))  # part des requêtes tracées sans en-tête X-Trace
+BOUCLE_INTERVALLE = 0.5
+
+BUCKETS_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+BUCKETS_TOKENS = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000)
+
+_registre = []
+
+
+def _echapper(valeur) -> str:
+    return str(valeur).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquettes(noms, valeurs, extra: str = "") -> str:
+    morceaux = [f'{nom}="{_echapper(valeur)}"' for nom, valeur in zip(noms, valeurs)]
+    if extra:
+        morceaux.append(extra)
+    return "{" + ",".join(morceaux) + "}" if morceaux else ""
+
+
+class Compteur:
+    type = "counter"
+
+    def __init__(self, nom: str, aide: str, etiquettes=()):
+        self.nom = nom
+        self.aide = aide
+        self.etiquettes = tuple(etiquettes)
+        self.valeurs = {}
+        _registre.append(self)
+
+    def _cle(self, etiquettes: dict) -> tuple:
+        return tuple(str(etiquettes.get(nom, "")) for nom in self.etiquettes)
+
+    def inc(self, valeur: float = 1, **etiquettes):
+        cle = self._cle(etiquettes)
+        self.valeurs[cle] = self.valeurs.get(cle, 0) + valeur
+
+    def lignes(self):
+        for cle, valeur in sorted(self.valeurs.items()):
+            yield f"{self.nom}{_etiquettes(self.etiquettes, cle)} {valeur}"
+
+
+class Jauge(Compteur):
+    type = "gauge"
+
+    def fixer(self, valeur: float, **etiquettes):
+        self.valeurs[self._cle(etiquettes)] = valeur
+
+
+class Histogramme(Compteur):
+    type = "histogram"
+
+    def __init__(self, nom: str, aide: str, etiquettes=(), buckets=BUCKETS_DUREE):
+        super().__init__(nom, aide, etiquettes)
+        self.buckets = tuple(buckets)
+
+    def observer(self, valeur: float, **etiquettes):
+        cle = self._cle(etiquettes)
+        serie = self.valeurs.setdefault(cle, {"buckets": [0] * len(self.buckets), "somme": 0.0, "total": 0})
+        for i, borne in enumerate(self.buckets):
+            if valeur <= borne:
+                serie["buckets"][i] += 1
+        serie["somme"] += valeur
+        serie["total"] += 1
+
+    def lignes(self):
+        for cle, serie in sorted(self.valeurs.items()):
+            for borne, nombre in zip(self.buckets, serie["buckets"]):
+                le = f'le="{borne}"'
+                yield f"{self.nom}_bucket{_etiquettes(self.etiquettes, cle, le)} {nombre}"
+            le = 'le="+Inf"'
+            yield f"{self.nom}_bucket{_etiquettes(self.etiquettes, cle, le)} {serie['total']}"
+            yield f"{self.nom}_sum{_etiquettes(self.etiquettes, cle)} {round(serie['somme'], 6)}"
+            yield f"{self.nom}_count{_etiquettes(self.etiquettes, cle)} {serie['total']}"
+
+
+def exposer() -> str:
+    blocs = []
+    for metrique in _registre:
+        blocs.append(f"# HELP {metrique.nom} {metrique.aide}")
+        blocs.append(f"# TYPE {metrique.nom} {metrique.type}")
+        blocs.extend(metrique.lignes())
+    return "\n".join(blocs) + "\n"
+
+
+# --- Métriques de l'application ---
+http_requetes = Compteur("http_requetes_total", "Requêtes HTTP", ("methode", "route", "statut"))
+http_duree = Histogramme("http_duree_secondes", "Durée des requêtes HTTP (jusqu'aux en-têtes)", ("methode", "route"))
+llm_appels = Compteur("llm_appels_total", "Appels LLM par étape et issue (ok, erreur, cache)", ("etape", "modele", "statut"))
+llm_duree = Histogramme("llm_duree_secondes", "Latence des appels LLM", ("etape", "modele", "jour"))
+llm_tokens = Histogramme("llm_tokens", "Tokens par appel LLM", ("etape", "type"), buckets=BUCKETS_TOKENS)
+llm_bascules = Compteur("llm_bascules_total", "Bascules sur le modèle candidat suivant", ("etape", "modele"))
+secours = Compteur("secours_total", "Erreurs remplacées par un contenu de secours", ("etape", "erreur"))
+etape_duree = Histogramme("pipeline_etape_duree_secondes", "Durée des étapes de pipeline", ("pipeline", "etape"))
+stockage_duree = Histogramme("stockage_duree_secondes", "Durée des lectures / écritures SQLite", ("operation", "document"))
+boucle_retard = Jauge("boucle_retard_secondes", "Retard de la boucle asyncio (dernière mesure)")
+boucle_retard_max = Jauge("boucle_retard_max_secondes", "Retard maximal de la boucle asyncio depuis le démarrage")
+
+# jour en cours de génération (étiquette "jour" des appels LLM)
+jour_courant = contextvars.ContextVar("jour_courant", default="")
+
+
+def compter_secours(etape: str, erreur: BaseException):
+    # Les `except` qui remplacent une erreur par un texte de secours passent par ici : plus d'échec silencieux
+    secours.inc(etape=etape, erreur=erreur.__class__.__name__)
+    logger.warning("Secours pour %s : %s: %s", etape, erreur.__class__.__name__, erreur)
+
+
+def observer_llm(etape: str, modele: str, statut: str, duree: float = None, usage: dict = None):
+    etape = etape or "autre"
+    llm_appels.inc(etape=etape, modele=modele, statut=statut)
+    if duree is not None:
+        llm_duree.observer(duree, etape=etape, modele=modele, jour=jour_courant.get())
+    for cle, type_tokens in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+        if usage and isinstance(usage.get(cle), (int, float)):
+            llm_tokens.observer(usage[cle], etape=etape, type=type_tokens)
+
+
+# --- Traces ---
+# Une trace = {"debut": t0, "spans": [...]} ; partagée par toutes les tâches lancées depuis la requête / le job.
+trace_courante = contextvars.ContextVar("trace_courante", default=None)
+
+
+def doit_tracer(entete: str = None) -> bool:
+    return TRACE_TOUJOURS or entete == "1" or (TRACE_ECHANTILLON > 0 and random.random() < TRACE_ECHANTILLON)
+
+
+def demarrer_trace():
+    # Renvoie le jeton du ContextVar (à passer à terminer_trace)
+    return trace_courante.set({"debut": time.perf_counter(), "spans": []})
+
+
+def terminer_trace(jeton) -> list:
+    trace = trace_courante.get()
+    trace_courante.reset(jeton)
+    return trace["spans"] if trace else []
+
+
+def ajouter_span(nom: str, depart: float, fin: float, **attributs):
+    trace = trace_courante.get()
+    if trace is None:
+        return
+    trace["spans"].append({
+        "nom": nom,
+        "debut_ms": round((depart - trace["debut"]) * 1000, 1),
+        "duree_ms": round((fin - depart) * 1000, 1),
+        **{cle: valeur for cle, valeur in attributs.items() if valeur not in (None, "")},
+    })
+
+
+def server_timing(spans: list) -> str:
+    # En-tête Server-Timing (visible dans l'onglet réseau du navigateur)
+    return ", ".join(f"{s['nom'].replace(' ', '_')};dur={s['duree_ms']}" for s in spans[:30])
+
+
+async def surveiller_boucle():
+    # Mesure le retard d'un sleep court : si la boucle est bloquée (calcul CPU, I/O synchrone), il grandit
+    maximum = 0.0
+    while True:
+        depart = time.perf_counter()
+        await asyncio.sleep(BOUCLE_INTERVALLE)
+        retard = max(0.0, time.perf_counter() - depart - BOUCLE_INTERVALLE)
+        maximum = max(maximum, retard)
+        boucle_retard.fixer(round(retard, 6))
+        boucle_retard_max.fixer(round(maximum, 6))
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import logging
+from collections import deque
+
+# Routage des modèles par étape : chaque étape (classification, jour, liste...) a sa liste de modèles
+# candidats, son max_tokens et sa température. On suit la latence (p50/p95) et le taux d'erreur de chaque
+# modèle sur une fenêtre glissante ; un modèle lent ou en erreur passe derrière les autres candidats.
+logger = logging.getLogger("monprojetia.modeles")
+
+MODELE_PAR_DEFAUT = "anthropic/claude-3-haiku"
+# Modèle de secours sur opt-in seulement (ex. "openai/gpt-4o-mini") : il reçoit les profils des utilisateurs
+MODELE_SECOURS = os.getenv("LLM_MODELE_SECOURS", "")
+# fichier JSON optionnel {"etape": {"modeles": [...], "max_tokens": ..., "temperature": ..., "p95_max": ...}}
+FICHIER_CONFIG = os.getenv("LLM_MODELES", "backend/data/modeles.json")
+FENETRE = int(os.getenv("LLM_FENETRE_STATS", "100"))  # nb d'appels gardés par modèle
+ERREURS_MAX = float(os.getenv("LLM_TAUX_ERREUR_MAX", "0.5"))
+APPELS_MIN = 5  # en dessous on ne juge pas un modèle
+
+_candidats = [MODELE_PAR_DEFAUT] + ([MODELE_SECOURS] if MODELE_SECOURS else [])
+
+# Réglages par défaut. max_tokens / temperature None = valeur par défaut du modèle (on n'envoie rien) :
+# un plafond se met dans LLM_MODELES, pas ici (un training détaillé sur plusieurs jours serait tronqué).
+# p95_max (s) : au-delà, le modèle est considéré lent pour cette étape.
+ETAPES = {
+    "classification": {"modeles": _candidats, "max_tokens": None, "temperature": 0, "p95_max": 5},
+    "jour": {"modeles": _candidats, "max_tokens": None, "temperature": None, "p95_max": 30},
+    "semaine": {"modeles": _candidats, "max_tokens": 4000, "temperature": None, "p95_max": 90},  # déjà le cas avant le routage
+    "liste": {"modeles": _candidats, "max_tokens": None, "temperature": None, "p95_max": 40},
+    "training": {"modeles": _candidats, "max_tokens": None, "temperature": None, "p95_max": 40},
+    "reponse": {"modeles": _candidats, "max_tokens": None, "temperature": None, "p95_max": 30},
+    "edition": {"modeles": _candidats, "max_tokens": None, "temperature": 0, "p95_max": 15},
+}
+
+
+def charger(fichier: str = FICHIER_CONFIG):
+    # Surcharge des réglages sans toucher au code ; les étapes absentes du fichier gardent les défauts
+    if not os.path.isfile(fichier):
+        return
+    try:
+        with open(fichier, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (OSError, ValueError):
+        logger.warning("Config des modèles illisible : %s", fichier)
+        return
+    for etape, reglages in config.items():
+        if isinstance(reglages, dict):
+            ETAPES[etape] = {**ETAPES.get(etape, {"modeles": _candidats}), **reglages}
+
+
+charger()
+
+
+class StatsModele:
+    def __init__(self, taille: int = FENETRE):
+        self.appels = deque(maxlen=taille)  # (durée en s, succès)
+
+    def ajouter(self, duree: float, succes: bool):
+        self.appels.append((duree, succes))
+
+    def percentile(self, p: float):
+        durees = sorted(duree for duree, succes in self.appels if succes)
+        if not durees:
+            return None
+        return durees[min(len(durees) - 1, int(p * len(durees)))]
+
+    def taux_erreur(self) -> float:
+        if not self.appels:
+            return 0.0
+        return sum(not succes for _, succes in self.appels) / len(self.appels)
+
+    def resume(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        return {
+            "appels": len(self.appels),
+            "p50_ms": None if p50 is None else round(p50 * 1000),
+            "p95_ms": None if p95 is None else round(p95 * 1000),
+            "taux_erreur": round(self.taux_erreur(), 3),
+        }
+
+
+_stats = {}
+
+
+def stats_modele(modele: str) -> StatsModele:
+    if modele not in _stats:
+        _stats[modele] = StatsModele()
+    return _stats[modele]
+
+
+def enregistrer(modele: str, debut: float, succes: bool):
+    stats_modele(modele).ajouter(time.perf_counter() - debut, succes)
+
+
+def reglages(etape: str) -> dict:
+    return ETAPES.get(etape) or {"modeles": [MODELE_PAR_DEFAUT]}
+
+
+def _en_forme(modele: str, p95_max) -> bool:
+    stats = stats_modele(modele)
+    if len(stats.appels) < APPELS_MIN:
+        return True
+    if stats.taux_erreur() > ERREURS_MAX:
+        return False
+    p95 = stats.percentile(0.95)
+    return p95_max is None or p95 is None or p95 <= p95_max
+
+
+def candidats(etape: str) -> list:
+    # Ordre de la config, en faisant passer les modèles lents / en erreur en dernier (jamais exclus :
+    # s'ils sont tous mauvais on essaie quand même)
+    config = reglages(etape)
+    modeles = list(dict.fromkeys(config.get("modeles") or [MODELE_PAR_DEFAUT]))
+    return sorted(modeles, key=lambda modele: not _en_forme(modele, config.get("p95_max")))
+
+
+def parametres(etape: str) -> dict:
+    # max_tokens / temperature à envoyer à OpenRouter
+    config = reglages(etape)
+    return {cle: config[cle] for cle in ("max_tokens", "temperature") if config.get(cle) is not None}
+
+
+def stats() -> dict:
+    return {
+        "modeles": {modele: s.resume() for modele, s in _stats.items()},
+        "etapes": {etape: candidats(etape) for etape in ETAPES},
+    }
@@ -0,0 +1,58 @@
+import os
+import hashlib
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi.responses import HTMLResponse, Response
+from backend import statique
+
+# Cache HTTP des pages de plan (/planning, /liste, /training) : l'ETag dépend de la version du document
+# de l'utilisateur (storage), du template et des fichiers statiques -> un rechargement sans changement
+# renvoie 304. Le HTML rendu est gardé en mémoire sous cette même clé : une écriture change la version,
+# donc l'ancienne entrée n'est plus jamais demandée (elle sort du LRU).
+FRAGMENTS_MAX = int(os.getenv("PAGES_CACHE_MAX", "256"))
+CACHE_CONTROL = "private, no-cache"  # le navigateur garde la page mais revalide (304) à chaque visite
+
+_fragments = OrderedDict()
+
+
+def calculer_etag(template: str, email: str, version: int) -> str:
+    try:
+        modif_template = os.path.getmtime(os.path.join("templates", template))
+    except OSError:
+        modif_template = 0
+    cle = f"{template}|{email}|{version}|{modif_template}|{statique.VERSION}"
+    return f'W/"{hashlib.sha256(cle.encode()).hexdigest()[:20]}"'
+
+
+def non_modifie(request, etag: str, maj: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [valeur.strip() for valeur in if_none_match.split(",")]
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(maj) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def rendre(request, templates, template: str, email: str, etat, contexte) -> Response:
+    # `etat` = storage.etat(...) du document affiché ; `contexte()` n'est appelé qu'en cas de cache manqué
+    if etat is None:
+        return templates.TemplateResponse(template, {"request": request, **contexte()})
+    version, maj = etat
+    etag = calculer_etag(template, email, version)
+    entetes = {"ETag": etag, "Last-Modified": formatdate(maj, usegmt=True), "Cache-Control": CACHE_CONTROL}
+    if non_modifie(request, etag, maj):
+        return Response(status_code=304, headers=entetes)
+
+    html = _fragments.get(etag)
+    if html is None:
+        html = templates.get_template(template).render({"request": request, **contexte()})
+        _fragments[etag] = html
+        if len(_fragments) > FRAGMENTS_MAX:
+            _fragments.popitem(last=False)
+    else:
+        _fragments.move_to_end(etag)
+    return HTMLResponse(html, headers=entetes)
@@ -0,0 +1,76 @@
+import time
+import asyncio
+import logging
+from backend import metriques
+
+logger = logging.getLogger("monprojetia.pipeline")
+
+
+class Etape:
+    # `fonction` est une coroutine qui reçoit le dict {nom_dependance: resultat}
+    def __init__(self, nom: str, fonction, dependances=()):
+        self.nom = nom
+        self.fonction = fonction
+        self.dependances = list(dependances)
+
+
+class ErreurDependance(Exception):
+    pass
+
+
+async def executer(etapes: list, nom: str = "pipeline", sur_etape=None):
+    # Lance chaque étape dès que ses dépendances sont terminées.
+    # Retourne (resultats, durees) ; une étape en erreur a l'exception comme résultat
+    # et les étapes qui en dépendent échouent avec ErreurDependance.
+    # `sur_etape(nom, statut, resultat)` est appelé à chaque changement d'état (suivi de progression).
+    def signaler(nom_etape, statut, resultat=None):
+        if sur_etape is not None:
+            sur_etape(nom_etape, statut, resultat)
+
+    noms = {etape.nom for etape in etapes}
+    for etape in etapes:
+        inconnues = [d for d in etape.dependances if d not in noms]
+        if inconnues:
+            raise ValueError(f"Étape {etape.nom} : dépendances inconnues {inconnues}")
+
+    debut = time.perf_counter()
+    taches = {}
+    durees = {}
+
+    async def lancer(etape):
+        entrees = {}
+        for dep in etape.dependances:
+            try:
+                entrees[dep] = await taches[dep]
+            except Exception as e:
+                signaler(etape.nom, "echoue")
+                raise ErreurDependance(f"{etape.nom} : l'étape {dep} a échoué") from e
+        depart = time.perf_counter()
+        signaler(etape.nom, "en_cours")
+        try:
+            resultat = await etape.fonction(entrees)
+        except Exception:
+            signaler(etape.nom, "echoue")
+            raise
+        else:
+            signaler(etape.nom, "termine", resultat)
+            return resultat
+        finally:
+            fin = time.perf_counter()
+            metriques.etape_duree.observer(fin - depart, pipeline=nom, etape=etape.nom)
+            metriques.ajouter_span("etape", depart, fin, pipeline=nom, etape=etape.nom)
+            durees[etape.nom] = {
+                "debut": round(depart - debut, 3),
+                "fin": round(fin - debut, 3),
+                "duree": round(fin - depart, 3),
+            }
+
+    for etape in etapes:
+        taches[etape.nom] = asyncio.ensure_future(lancer(etape))
+
+    issues = await asyncio.gather(*taches.values(), return_exceptions=True)
+    resultats = dict(zip(taches.keys(), issues))
+
+    total = round(time.perf_counter() - debut, 3)
+    logger.info("%s terminé en %ss : %s", nom, total, durees)
+    return resultats, durees
@@ -0,0 +1,173 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import unicodedata
+from backend.utils import JOURS
+from backend.llm import completer
+from backend.semaine import extraire_json
+
+# Routage des messages du coach : intention (modifsport / modifnutrition / nomodif) + jours concernés.
+# Un classifieur à règles répond tout de suite aux messages évidents ; sinon un seul appel IA
+# renvoie les deux informations en JSON. Chaque décision est journalisée (taux de chemin rapide, précision).
+logger = logging.getLogger("monprojetia.routage")
+
+INTENTIONS = ("modifsport", "modifnutrition", "nomodif")
+SEUIL_CONFIANCE = float(os.getenv("ROUTAGE_SEUIL", "0.8"))
+# part des décisions locales re-vérifiées par l'IA en tâche de fond pour mesurer la précision
+ECHANTILLON_VERIFICATION = float(os.getenv("ROUTAGE_ECHANTILLON", "0.05"))
+JOURNAL = os.getenv("ROUTAGE_JOURNAL", "backend/data/routage.jsonl")
+
+MOTS_MODIF = [
+    "remplace", "change", "modifi", "enleve", "retire", "supprime", "ajoute", "mets ", "met ", "evite",
+    "plus de ", "sans ", "je veux", "je voudrais", "je ne veux", "je n'aime pas", "j'aime pas", "allergi",
+    "a la place", "au lieu", "moins de ", "davantage", "refai", "regenere", "adapte",
+]
+MOTS_SPORT = [
+    "entrainement", "seance", "sport", "exercice", "muscu", "cardio", "course", "courir", "squat", "pompe", "abdo",
+    "training", "footing", "velo", "natation", "repetition", "serie", "etirement", "gainage", "hiit", "salle",
+]
+MOTS_NUTRITION = [
+    "repas", "manger", "petit dej", "petit-dej", "dejeuner", "diner", "plat", "aliment", "poisson", "viande",
+    "legume", "fruit", "recette", "menu", "nutrition", "calorie", "proteine", "gouter", "collation", "midi", "soir",
+    "poulet", "riz", "pates", "oeuf", "fromage", "lait", "vegetarien", "vegan", "gluten", "sucre",
+]
+DEBUTS_QUESTION = (
+    "pourquoi", "comment", "est-ce", "est ce", "combien", "quel", "quelle", "c'est quoi", "qu'est-ce", "que ",
+    "quand", "dois-je", "peut-on", "faut-il", "est il", "est-il",
+)
+
+_compteurs = {"total": 0, "local": 0, "ia": 0, "defaut": 0, "verifications": 0, "accords": 0}
+
+
+def _normaliser(texte: str) -> str:
+    texte = unicodedata.normalize("NFD", texte.lower())
+    texte = "".join(c for c in texte if unicodedata.category(c) != "Mn")
+    return texte.replace("’", "'")
+
+
+def jours_du_message(message: str):
+    # Jours cités explicitement ; None si le message n'en dit rien
+    texte = _normaliser(message)
+    if re.search(r"\btous les jours\b|\btoute la semaine\b|\bchaque jour\b|\bla semaine\b", texte):
+        return list(JOURS)
+    jours = [jour for jour in JOURS if re.search(rf"\b{_normaliser(jour)}s?\b", texte)]
+    if re.search(r"\bweek-?end\b", texte):
+        jours += [jour for jour in ("Samedi", "Dimanche") if jour not in jours]
+    return jours or None
+
+
+def classer_localement(message: str) -> dict:
+    texte = _normaliser(message).strip()
+    modif = any(mot in texte for mot in MOTS_MODIF)
+    question = texte.endswith("?") or texte.startswith(DEBUTS_QUESTION)
+    sport = sum(mot in texte for mot in MOTS_SPORT)
+    nutrition = sum(mot in texte for mot in MOTS_NUTRITION)
+    jours = jours_du_message(message)
+
+    if question and not modif:
+        return {"intention": "nomodif", "jours": [], "confiance": 0.9}
+    if modif and sport and not nutrition:
+        decision = {"intention": "modifsport", "jours": jours or [], "confiance": 0.9}
+    elif modif and nutrition and not sport:
+        # sans jour cité on ne sait pas quoi régénérer : on laisse l'IA trancher
+        decision = {"intention": "modifnutrition", "jours": jours or list(JOURS), "confiance": 0.9 if jours else 0.6}
+    elif modif:
+        intention = "modifsport" if sport > nutrition else "modifnutrition"
+        decision = {"intention": intention, "jours": jours or list(JOURS), "confiance": 0.5}
+    else:
+        return {"intention": "nomodif", "jours": [], "confiance": 0.4}
+    if question:
+        # "Comment faire plus de pompes ?" : mot de modification dans une question, l'IA tranche
+        decision["confiance"] = min(decision["confiance"], 0.6)
+    return decision
+
+
+def _prompt(message: str) -> str:
+    return (
+        f"Un utilisateur t’envoie cette requête :\n\n\"{message}\"\n\n"
+        "Dis si cela concerne une demande de modification du planning d'entraînement (modifsport), une demande de "
+        "modification du planning de nutrition (modifnutrition) ou une question n'amenant pas à des modifications "
+        "(nomodif). Ne te base pas sur les mots clés mais réfléchis vraiment si l'utilisateur cherche une modification "
+        "ou simplement des infos : une question de nutrition ou de sport peut être posée à titre informatif. "
+        "Indique aussi les jours de la semaine concernés par sa demande. "
+        f"Réponds uniquement avec un objet JSON : {{\"intention\": \"modifsport|modifnutrition|nomodif\", "
+        f"\"jours\": [\"Lundi\", ...] ou \"tous\"}}, jours parmi {', '.join(JOURS)}."
+    )
+
+
+async def _demander_ia(message: str):
+    donnees = extraire_json(await completer(_prompt(message), etape="classification"))
+    if not isinstance(donnees, dict) or donnees.get("intention") not in INTENTIONS:
+        return None
+    jours = donnees.get("jours")
+    if jours == "tous" or (isinstance(jours, list) and "tous" in [str(j).lower() for j in jours]):
+        jours = list(JOURS)
+    elif isinstance(jours, list):
+        cites = {str(j).strip().lower() for j in jours}
+        jours = [jour for jour in JOURS if jour.lower() in cites]
+    else:
+        jours = []
+    if donnees["intention"] == "modifnutrition" and not jours:
+        jours = list(JOURS)  # même comportement qu'avant : aucun jour reconnu -> toute la semaine
+    return {"intention": donnees["intention"], "jours": jours}
+
+
+def _journaliser(entree: dict):
+    entree["date"] = time.time()
+    try:
+        os.makedirs(os.path.dirname(JOURNAL), exist_ok=True)
+        with open(JOURNAL, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entree, ensure_ascii=False) + "\n")
+    except OSError:
+        logger.warning("Impossible d'écrire le journal de routage")
+
+
+async def _verifier(message: str, local: dict):
+    # Vérification en tâche de fond d'une décision prise sur le chemin rapide
+    try:
+        ia = await _demander_ia(message)
+    except Exception:
+        return
+    if ia is None:
+        return
+    accord = ia["intention"] == local["intention"] and (local["intention"] != "modifnutrition" or ia["jours"] == local["jours"])
+    _compteurs["verifications"] += 1
+    _compteurs["accords"] += accord
+    _journaliser({"type": "verification", "message": message, "local": local, "ia": ia, "accord": accord})
+
+
+async def router(message: str) -> dict:
+    debut = time.perf_counter()
+    local = classer_localement(message)
+    _compteurs["total"] += 1
+
+    if local["confiance"] >= SEUIL_CONFIANCE:
+        decision = {"intention": local["intention"], "jours": local["jours"], "source": "local"}
+        if random.random() < ECHANTILLON_VERIFICATION:
+            asyncio.ensure_future(_verifier(message, local))
+    else:
+        try:
+            ia = await _demander_ia(message)
+        except Exception:
+            ia = None
+        if ia is not None:
+            decision = dict(ia, source="ia")
+        else:
+            # l'IA ne répond pas : on garde la meilleure supposition locale
+            decision = {"intention": local["intention"], "jours": local["jours"], "source": "defaut"}
+
+    _compteurs[decision["source"]] += 1
+    decision["duree_ms"] = round((time.perf_counter() - debut) * 1000, 1)
+    _journaliser({"type": "decision", "message": message, "local": local, **decision})
+    return decision
+
+
+def stats() -> dict:
+    resultat = dict(_compteurs)
+    resultat["taux_local"] = round(_compteurs["local"] / _compteurs["total"], 3) if _compteurs["total"] else 0.0
+    resultat["precision_locale"] = round(_compteurs["accords"] / _compteurs["verifications"], 3) if _compteurs["verifications"] else None
+    return resultat
@@ -1,14 +1,11 @@
-import os
-import json
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import RedirectResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
+from backend import storage, auth, statique
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
-
-DATA_DIR = "backend/data"
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
+templates.env.globals["static_url"] = statique.static_url
 
 # Accueil avec choix
 @router.get("/", response_class=HTMLResponse)
@@ -22,22 +19,11 @@ async def register_get(request: Request):
 
 @router.post("/register", response_class=HTMLResponse)
 async def register_post(request: Request, email: str = Form(...), password: str = Form(...)):
-    os.makedirs(DATA_DIR, exist_ok=True)
-    users = {}
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "r", encoding="utf-8") as f:
-            users = json.load(f)
-
-    if email in users:
+    # hachage dans le pool de threads de backend.auth : la boucle reste libre
+    empreinte = await auth.hacher_async(password)
+    if not storage.creer_compte(email, empreinte):
         return templates.TemplateResponse("register.html", {"request": request, "error": "Email déjà utilisé."})
 
-    users[email] = password
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, indent=2)
-
-    user_dir = os.path.join(DATA_DIR, "utilisateurs", email)
-    os.makedirs(user_dir, exist_ok=True)
-
     response = RedirectResponse(url="/presentation", status_code=303)
     return response
 
@@ -48,18 +34,20 @@ async def login_get(request: Request):
 
 @router.post("/login", response_class=HTMLResponse)
 async def login_post(request: Request, email: str = Form(...), password: str = Form(...)):
-    if not os.path.exists(USERS_FILE):
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Aucun compte trouvé."})
-
-    with open(USERS_FILE, "r", encoding="utf-8") as f:
-        users = json.load(f)
+    empreinte = storage.lire_empreinte(email)
+    if empreinte is None:
+        # même coût de calcul qu'un vrai compte pour ne pas révéler quels emails existent
+        await auth.verifier_async(password, auth.EMPREINTE_FACTICE)
+        return templates.TemplateResponse("login.html", {"request": request, "error": "Identifiants invalides."})
 
-    if email not in users or users[email] != password:
+    if not await auth.verifier_async(password, empreinte):
         return templates.TemplateResponse("login.html", {"request": request, "error": "Identifiants invalides."})
 
+    if auth.doit_rehacher(empreinte):
+        storage.maj_empreinte(email, await auth.hacher_async(password))
+
     # ✅ On mémorise l'utilisateur connecté
-    with open(os.path.join(DATA_DIR, "session.json"), "w", encoding="utf-8") as f:
-        json.dump({"email": email}, f)
+    storage.ecrire_session(email)
 
     # Utilisateur connecté → redirection vers vraie page d'accueil
     return RedirectResponse(url="/accueil", status_code=303)
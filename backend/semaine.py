@@ -0,0 +1,84 @@
+import json
+from backend.utils import JOURS
+
+# Génération de la semaine en un seul appel : l'IA renvoie du JSON, validé ici jour par jour.
+REPAS = ["matin", "midi", "soir"]
+
+
+def prompt_semaine(formulaire: dict, feedback: str = None) -> str:
+    exemple = {"Lundi": {"matin": [{"aliment": "flocons d'avoine", "grammes": 60}], "midi": ["..."], "soir": ["..."]}, "Mardi": "..."}
+    remarque = f"Remarque de l’utilisateur cette semaine : {feedback}. " if feedback else ""
+    return (
+        f"Tu es un expert en nutrition. Génère le planning des 7 jours de la semaine ({', '.join(JOURS)}) : "
+        f"pour chaque jour 3 repas équilibrés (matin, midi, soir) avec les grammages, adaptés à un profil de "
+        f"{formulaire['age']} ans, {formulaire['poids']} kg, {formulaire['taille']} cm, sexe {formulaire['sexe']}, "
+        f"objectif {formulaire['objectif']}, activité {formulaire['activite']}, "
+        f"régime alimentaire : {formulaire['regime']}, allergies : {formulaire['allergies']}, budget hebdo : {formulaire['budget']}€. "
+        f"L’utilisateur a précisé : {formulaire['precision']}. "
+        f"{remarque}"
+        f"Adapte les repas pour respecter le régime et éviter les allergènes. "
+        f"essaye d utiliser des ingredients relativement simples, pas cher, faciles à trouver et connus mais maintien tout de meme une diversité selon les jours de la semaine, pour manger varier mais limiter la friction due aux aliments, evite par exemple le tofu ou les graines de chia. "
+        f"le budget est primordial, assure toi que ce qui est dépensé dans la semaine en nourriture ne dépasse en aucun cas {formulaire['budget']}€, base toi sur le prix moyen des aliments en france en euros. "
+        f"Réponds UNIQUEMENT avec un objet JSON valide, sans texte autour, de la forme : {json.dumps(exemple, ensure_ascii=False)} "
+        f"avec les 7 jours, et pour chaque repas la liste des aliments avec leur quantité en grammes (nombre)."
+    )
+
+
+def extraire_json(texte: str):
+    # L'IA entoure parfois le JSON de ```json ... ``` ou d'une phrase : on prend le premier objet complet
+    debut = texte.find("{")
+    fin = texte.rfind("}")
+    if debut == -1 or fin <= debut:
+        return None
+    try:
+        return json.loads(texte[debut:fin + 1])
+    except ValueError:
+        return None
+
+
+def valider_jour(donnees) -> bool:
+    if not isinstance(donnees, dict):
+        return False
+    for repas in REPAS:
+        aliments = donnees.get(repas)
+        if not isinstance(aliments, list) or not aliments:
+            return False
+        for aliment in aliments:
+            if not isinstance(aliment, dict):
+                return False
+            nom = aliment.get("aliment")
+            grammes = aliment.get("grammes")
+            if not isinstance(nom, str) or not nom.strip():
+                return False
+            if isinstance(grammes, bool) or not isinstance(grammes, (int, float)) or grammes <= 0:
+                return False
+    return True
+
+
+def valider_semaine(texte: str) -> dict:
+    # Retourne {jour: repas} pour les jours valides ; les jours absents sont à redemander
+    donnees = extraire_json(texte)
+    if not isinstance(donnees, dict):
+        return {}
+    # l'IA peut mettre les jours en minuscules
+    par_nom = {str(cle).strip().lower(): valeur for cle, valeur in donnees.items()}
+    valides = {}
+    for jour in JOURS:
+        repas = par_nom.get(jour.lower())
+        if valider_jour(repas):
+            valides[jour] = {nom: repas[nom] for nom in REPAS}
+    return valides
+
+
+def rendre_jour(repas: dict) -> str:
+    # Texte affiché dans planning.html (même rendu que les plannings générés jour par jour)
+    lignes = []
+    for nom in REPAS:
+        lignes.append(f"{nom.capitalize()} :")
+        for aliment in repas[nom]:
+            grammes = aliment["grammes"]
+            if float(grammes).is_integer():
+                grammes = int(grammes)
+            lignes.append(f"- {aliment['aliment'].strip()} : {grammes} g")
+        lignes.append("")
+    return "\n".join(lignes).strip()
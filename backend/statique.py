@@ -0,0 +1,99 @@
+import os
+import gzip
+import hashlib
+import logging
+import mimetypes
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import FileResponse, Response
+
+try:
+    import brotli
+except ImportError:  # dépendance optionnelle : sans elle on sert seulement la version gzip
+    brotli = None
+
+# Fichiers statiques empreintés : style.<hash>.css est servi avec "Cache-Control: immutable" (un an),
+# l'URL change dès que le contenu change. Les fichiers texte sont précompressés (gzip / brotli) au démarrage.
+# Dans les templates : {{ static_url('style.css') }}
+logger = logging.getLogger("monprojetia.statique")
+
+DOSSIER = "static"
+DOSSIER_COMPRESSE = os.getenv("STATIQUE_CACHE", "backend/data/static")
+A_COMPRESSER = {".css", ".js", ".svg", ".html", ".json", ".txt", ".map"}  # png / jpg sont déjà compressés
+CACHE_IMMUABLE = "public, max-age=31536000, immutable"
+CACHE_COURT = "public, max-age=3600"
+
+_manifeste = {}  # "style.css" -> "style.1a2b3c4d5e.css"
+_fichiers = {}  # "style.1a2b3c4d5e.css" -> {"chemin", "type", "gzip", "br"}
+VERSION = ""  # change dès qu'un fichier statique change (entre dans l'ETag des pages)
+
+
+def _compresser(chemin: str, contenu: bytes, extension: str, compression) -> str:
+    # Écrit la version compressée si elle n'existe pas déjà ; None si elle ne fait pas gagner assez
+    sortie = os.path.join(DOSSIER_COMPRESSE, os.path.basename(chemin) + extension)
+    if not os.path.isfile(sortie):
+        compresse = compression(contenu)
+        if len(compresse) > len(contenu) * 0.9:
+            return None
+        os.makedirs(DOSSIER_COMPRESSE, exist_ok=True)
+        with open(sortie + ".tmp", "wb") as f:
+            f.write(compresse)
+        os.replace(sortie + ".tmp", sortie)
+    return sortie
+
+
+def construire(dossier: str = DOSSIER):
+    global VERSION
+    _manifeste.clear()
+    _fichiers.clear()
+    if not os.path.isdir(dossier):
+        return
+    for nom in sorted(os.listdir(dossier)):
+        chemin = os.path.join(dossier, nom)
+        if not os.path.isfile(chemin):
+            continue
+        with open(chemin, "rb") as f:
+            contenu = f.read()
+        base, extension = os.path.splitext(nom)
+        empreinte = f"{base}.{hashlib.sha256(contenu).hexdigest()[:10]}{extension}"
+        fichier = {"chemin": chemin, "type": mimetypes.guess_type(nom)[0] or "application/octet-stream", "gzip": None, "br": None}
+        if extension.lower() in A_COMPRESSER:
+            cible = os.path.join(DOSSIER_COMPRESSE, empreinte)
+            fichier["gzip"] = _compresser(cible, contenu, ".gz", lambda c: gzip.compress(c, compresslevel=9, mtime=0))
+            if brotli is not None:
+                fichier["br"] = _compresser(cible, contenu, ".br", lambda c: brotli.compress(c, quality=11))
+        _manifeste[nom] = empreinte
+        _fichiers[empreinte] = fichier
+    VERSION = hashlib.sha256(" ".join(sorted(_fichiers)).encode()).hexdigest()[:10]
+    logger.info("%s fichiers statiques empreintés", len(_fichiers))
+
+
+def static_url(nom: str) -> str:
+    # Fichier inconnu (pas encore ajouté dans static/) : URL simple, servie sans cache long
+    return f"/static/{_manifeste.get(nom, nom)}"
+
+
+class StatiqueImmuable(StaticFiles):
+    # StaticFiles de Starlette + versions empreintées / précompressées ; les anciennes URL
+    # (/static/bi.png dans le CSS en ligne) restent servies avec ETag et un cache d'une heure.
+    async def get_response(self, path: str, scope) -> Response:
+        fichier = _fichiers.get(path)
+        if fichier is None:
+            response = await super().get_response(path, scope)
+            if response.status_code == 200:
+                response.headers.setdefault("Cache-Control", CACHE_COURT)
+            return response
+
+        entetes = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        etag = f'"{path}"'  # le nom contient déjà le hash du contenu
+        if entetes.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_IMMUABLE})
+        accepte = entetes.get("accept-encoding", "")
+        headers = {"ETag": etag, "Cache-Control": CACHE_IMMUABLE, "Vary": "Accept-Encoding"}
+        for encodage in ("br", "gzip"):
+            if fichier[encodage] and encodage in accepte:
+                headers["Content-Encoding"] = encodage
+                return FileResponse(fichier[encodage], media_type=fichier["type"], headers=headers)
+        return FileResponse(fichier["chemin"], media_type=fichier["type"], headers=headers)
+
+
+construire()
@@ -0,0 +1,375 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from backend import metriques
+from backend.auth import PREFIXE_CLAIR
+
+# Stockage SQLite (mode WAL) des données utilisateurs, à la place des fichiers
+# backend/data/utilisateurs/<email>/*.json et de backend/data/session.json.
+# Un cache mémoire (LRU) sert les lectures ; il est vidé dès qu'un autre process a écrit (PRAGMA data_version).
+DB_PATH = os.getenv("DB_PATH", "backend/data/monprojetia.db")
+ANCIEN_DOSSIER = os.getenv("ANCIEN_DOSSIER", "backend/data/utilisateurs")
+ANCIEN_USERS = os.getenv("ANCIEN_USERS", "backend/data/users.json")
+CACHE_MAX = max(1, int(os.getenv("STOCKAGE_CACHE_MAX", "2000")))  # documents décodés gardés en mémoire par worker
+
+# nom du document (ancien fichier <nom>.json) -> table
+DOCUMENTS = {
+    "formulaire": "profils",
+    "planning": "plannings",
+    "liste": "listes",
+    "training": "trainings",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS utilisateurs (
+    email TEXT PRIMARY KEY,
+    cree REAL NOT NULL,
+    mot_de_passe TEXT
+);
+CREATE TABLE IF NOT EXISTS session (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    email TEXT
+);
+CREATE TABLE IF NOT EXISTS bibliotheque (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    filtre TEXT NOT NULL,
+    allergies TEXT NOT NULL,
+    vecteur BLOB NOT NULL,
+    profil TEXT NOT NULL,
+    planning TEXT NOT NULL,
+    liste TEXT NOT NULL,
+    training TEXT,
+    cree REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bibliotheque_filtre ON bibliotheque (filtre);
+""" + "".join(
+    f"""
+CREATE TABLE IF NOT EXISTS {table} (
+    email TEXT PRIMARY KEY,
+    contenu TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 1,
+    maj REAL NOT NULL
+);
+"""
+    for table in DOCUMENTS.values()
+)
+
+
+class DocumentIntrouvable(KeyError):
+    pass
+
+
+class ConflitVersion(Exception):
+    # Le document a été modifié (autre requête, autre worker) depuis qu'on l'a lu
+    pass
+
+
+_connexion = None
+_verrou = threading.RLock()
+_cache = OrderedDict()  # (nom, email) ou "session" -> entrée
+_data_version = None
+
+
+def _cle(email):
+    # "" = pas d'utilisateur connecté (ancien fallback backend/data/<fichier>.json)
+    return email or ""
+
+
+def connexion() -> sqlite3.Connection:
+    global _connexion
+    if _connexion is None:
+        os.makedirs(os.path.dirname(DB_PATH) or ".", exist_ok=True)
+        _connexion = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None, timeout=10)
+        _connexion.execute("PRAGMA journal_mode=WAL")
+        _connexion.execute("PRAGMA synchronous=NORMAL")
+        _connexion.execute("PRAGMA foreign_keys=ON")
+        _connexion.executescript(SCHEMA)
+        colonnes = [ligne[1] for ligne in _connexion.execute("PRAGMA table_info(utilisateurs)")]
+        if "mot_de_passe" not in colonnes:
+            # base créée avant l'ajout des comptes
+            _connexion.execute("ALTER TABLE utilisateurs ADD COLUMN mot_de_passe TEXT")
+    return _connexion
+
+
+class transaction:
+    # with transaction() as db: ... -> BEGIN IMMEDIATE / COMMIT (ROLLBACK en cas d'erreur)
+    def __enter__(self):
+        _verrou.acquire()
+        self.db = connexion()
+        self.db.execute("BEGIN IMMEDIATE")
+        # écritures d'un autre process commitées avant notre verrou : à voir maintenant, sinon le
+        # PRAGMA data_version relu à la fin les ferait passer pour les nôtres (cache jamais invalidé)
+        _verifier_cache(self.db)
+        return self.db
+
+    def __exit__(self, type_erreur, erreur, trace):
+        global _data_version
+        try:
+            if type_erreur is None:
+                self.db.execute("COMMIT")
+            else:
+                self.db.execute("ROLLBACK")
+                _cache.clear()
+            # nos propres écritures ne doivent pas invalider le cache
+            _data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            _verrou.release()
+        return False
+
+
+def _memoriser(cle, entree):
+    _cache[cle] = entree
+    _cache.move_to_end(cle)
+    while len(_cache) > CACHE_MAX:
+        _cache.popitem(last=False)
+
+
+def _verifier_cache(db):
+    # data_version change quand une AUTRE connexion (autre worker uvicorn, CLI...) a écrit
+    global _data_version
+    version = db.execute("PRAGMA data_version").fetchone()[0]
+    if version != _data_version:
+        _cache.clear()
+        _data_version = version
+
+
+def creer_utilisateur(email: str, db=None):
+    requete = "INSERT OR IGNORE INTO utilisateurs (email, cree) VALUES (?, ?)"
+    if db is not None:
+        db.execute(requete, (email, time.time()))
+    else:
+        with transaction() as db:
+            db.execute(requete, (email, time.time()))
+
+
+def creer_compte(email: str, empreinte: str) -> bool:
+    # Faux si l'email a déjà un mot de passe (un utilisateur importé sans mot de passe peut le définir)
+    with transaction() as db:
+        curseur = db.execute(
+            "INSERT INTO utilisateurs (email, cree, mot_de_passe) VALUES (?, ?, ?) "
+            "ON CONFLICT(email) DO UPDATE SET mot_de_passe = excluded.mot_de_passe WHERE utilisateurs.mot_de_passe IS NULL",
+            (email, time.time(), empreinte),
+        )
+        return curseur.rowcount == 1
+
+
+def lire_empreinte(email: str):
+    # Recherche par clé primaire (index), pas de lecture de tous les comptes
+    with _verrou:
+        ligne = connexion().execute("SELECT mot_de_passe FROM utilisateurs WHERE email = ?", (email,)).fetchone()
+    return ligne[0] if ligne else None
+
+
+def maj_empreinte(email: str, empreinte: str):
+    with transaction() as db:
+        db.execute("UPDATE utilisateurs SET mot_de_passe = ? WHERE email = ?", (empreinte, email))
+
+
+def lire_avec_version(nom: str, email: str = None):
+    table = DOCUMENTS[nom]
+    cle = (nom, _cle(email))
+    debut = time.perf_counter()
+    with _verrou:
+        db = connexion()
+        _verifier_cache(db)
+        if cle not in _cache:
+            ligne = db.execute(f"SELECT contenu, version, maj FROM {table} WHERE email = ?", (_cle(email),)).fetchone()
+            _memoriser(cle, None if ligne is None else (json.loads(ligne[0]), ligne[1], ligne[2]))
+        else:
+            _cache.move_to_end(cle)
+        entree = _cache[cle]
+    metriques.stockage_duree.observer(time.perf_counter() - debut, operation="lecture", document=nom)
+    metriques.ajouter_span("stockage", debut, time.perf_counter(), operation="lecture", document=nom)
+    if entree is None:
+        raise DocumentIntrouvable(f"{nom} introuvable pour {email or 'anonyme'}")
+    # copie : l'appelant peut modifier le dict sans toucher au cache
+    return json.loads(json.dumps(entree[0])), entree[1]
+
+
+def lire(nom: str, email: str = None) -> dict:
+    return lire_avec_version(nom, email)[0]
+
+
+def etat(nom: str, email: str = None):
+    # (version, date de mise à jour) sans décoder le contenu ; None si le document n'existe pas
+    cle = (nom, _cle(email))
+    with _verrou:
+        db = connexion()
+        _verifier_cache(db)
+        if cle in _cache:
+            entree = _cache[cle]
+            return None if entree is None else (entree[1], entree[2])
+        ligne = db.execute(f"SELECT version, maj FROM {DOCUMENTS[nom]} WHERE email = ?", (_cle(email),)).fetchone()
+    return None if ligne is None else (ligne[0], ligne[1])
+
+
+def ecrire(nom: str, contenu: dict, email: str = None, db=None, version_attendue: int = None) -> int:
+    # Écriture transactionnelle ; renvoie la nouvelle version du document.
+    # `version_attendue` : version lue avant modification (0 = document absent) ; ConflitVersion si elle a changé.
+    table = DOCUMENTS[nom]
+    texte = json.dumps(contenu, ensure_ascii=False)
+
+    def executer(db):
+        if version_attendue is not None:
+            ligne = db.execute(f"SELECT version FROM {table} WHERE email = ?", (_cle(email),)).fetchone()
+            actuelle = ligne[0] if ligne else 0
+            if actuelle != version_attendue:
+                raise ConflitVersion(f"{nom} de {email or 'anonyme'} : version {actuelle}, attendue {version_attendue}")
+        if email:
+            creer_utilisateur(email, db)
+        maj = time.time()
+        db.execute(
+            f"INSERT INTO {table} (email, contenu, version, maj) VALUES (?, ?, 1, ?) "
+            f"ON CONFLICT(email) DO UPDATE SET contenu = excluded.contenu, version = {table}.version + 1, maj = excluded.maj",
+            (_cle(email), texte, maj),
+        )
+        version = db.execute(f"SELECT version FROM {table} WHERE email = ?", (_cle(email),)).fetchone()[0]
+        _memoriser((nom, _cle(email)), (json.loads(texte), version, maj))
+        return version
+
+    if db is not None:
+        return executer(db)
+    debut = time.perf_counter()
+    with transaction() as db:
+        version = executer(db)
+    metriques.stockage_duree.observer(time.perf_counter() - debut, operation="ecriture", document=nom)
+    metriques.ajouter_span("stockage", debut, time.perf_counter(), operation="ecriture", document=nom)
+    return version
+
+
+def lister_profils() -> list:
+    # emails des utilisateurs ayant rempli le formulaire (pour les traitements par lot)
+    with _verrou:
+        return [ligne[0] for ligne in connexion().execute("SELECT email FROM profils WHERE email != '' ORDER BY email")]
+
+
+def ajouter_bibliotheque(filtre: str, allergies: list, vecteur: bytes, profil: dict, planning: dict, liste: dict, training: dict = None) -> int:
+    with transaction() as db:
+        curseur = db.execute(
+            "INSERT INTO bibliotheque (filtre, allergies, vecteur, profil, planning, liste, training, cree) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                filtre, json.dumps(allergies, ensure_ascii=False), vecteur, json.dumps(profil, ensure_ascii=False),
+                json.dumps(planning, ensure_ascii=False), json.dumps(liste, ensure_ascii=False),
+                None if training is None else json.dumps(training, ensure_ascii=False), time.time(),
+            ),
+        )
+        return curseur.lastrowid
+
+
+def index_bibliotheque(depuis_id: int = 0) -> list:
+    # lignes ajoutées après `depuis_id` : (id, filtre, allergies, vecteur, cree) ; le contenu est lu à part
+    with _verrou:
+        lignes = connexion().execute(
+            "SELECT id, filtre, allergies, vecteur, cree FROM bibliotheque WHERE id > ? ORDER BY id", (depuis_id,)
+        ).fetchall()
+    return [(i, filtre, json.loads(allergies), vecteur, cree) for i, filtre, allergies, vecteur, cree in lignes]
+
+
+def lire_bibliotheque(id_modele: int):
+    with _verrou:
+        ligne = connexion().execute(
+            "SELECT profil, planning, liste, training FROM bibliotheque WHERE id = ?", (id_modele,)
+        ).fetchone()
+    if ligne is None:
+        return None
+    profil, planning, liste, training = ligne
+    return {
+        "profil": json.loads(profil), "planning": json.loads(planning), "liste": json.loads(liste),
+        "training": None if training is None else json.loads(training),
+    }
+
+
+def lire_session():
+    with _verrou:
+        db = connexion()
+        _verifier_cache(db)
+        if "session" not in _cache:
+            ligne = db.execute("SELECT email FROM session WHERE id = 1").fetchone()
+            _memoriser("session", ligne[0] if ligne else None)
+        return _cache["session"]
+
+
+def ecrire_session(email: str):
+    with transaction() as db:
+        db.execute("INSERT INTO session (id, email) VALUES (1, ?) ON CONFLICT(id) DO UPDATE SET email = excluded.email", (email,))
+        _memoriser("session", email)
+
+
+def migrer(dossier: str = ANCIEN_DOSSIER) -> int:
+    # Import unique de l'ancienne arborescence JSON. Idempotent : un document déjà en base n'est pas écrasé.
+    importes = 0
+    racine = os.path.dirname(dossier)
+    sources = []
+    if os.path.isdir(dossier):
+        for email in sorted(os.listdir(dossier)):
+            if os.path.isdir(os.path.join(dossier, email)):
+                sources.append((email, os.path.join(dossier, email)))
+    sources.append((None, racine))  # anciens fichiers "sans utilisateur"
+
+    with transaction() as db:
+        for email, chemin in sources:
+            if email:
+                creer_utilisateur(email, db)
+            for nom, table in DOCUMENTS.items():
+                fichier = os.path.join(chemin, f"{nom}.json")
+                if not os.path.isfile(fichier):
+                    continue
+                try:
+                    with open(fichier, "r", encoding="utf-8") as f:
+                        contenu = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                curseur = db.execute(
+                    f"INSERT OR IGNORE INTO {table} (email, contenu, version, maj) VALUES (?, ?, 1, ?)",
+                    (_cle(email), json.dumps(contenu, ensure_ascii=False), os.path.getmtime(fichier)),
+                )
+                importes += curseur.rowcount
+
+        session = os.path.join(racine, "session.json")
+        if os.path.isfile(session):
+            try:
+                with open(session, "r", encoding="utf-8") as f:
+                    email = json.load(f).get("email")
+            except (OSError, ValueError):
+                email = None
+            if email:
+                db.execute("INSERT OR IGNORE INTO session (id, email) VALUES (1, ?)", (email,))
+    _cache.clear()
+    return importes
+
+
+def migrer_comptes(fichier: str = ANCIEN_USERS) -> int:
+    # Import de l'ancien users.json (mots de passe en clair, marqués pour être hachés à la
+    # prochaine connexion), puis le fichier est renommé pour ne plus être relu.
+    if not os.path.isfile(fichier):
+        return 0
+    with open(fichier, "r", encoding="utf-8") as f:
+        comptes = json.load(f)
+    with transaction() as db:
+        for email, mot_de_passe in comptes.items():
+            db.execute(
+                "INSERT INTO utilisateurs (email, cree, mot_de_passe) VALUES (?, ?, ?) "
+                "ON CONFLICT(email) DO UPDATE SET mot_de_passe = excluded.mot_de_passe WHERE utilisateurs.mot_de_passe IS NULL",
+                (email, time.time(), PREFIXE_CLAIR + mot_de_passe),
+            )
+    os.replace(fichier, fichier + ".importe")
+    return len(comptes)
+
+
+def migrer_si_necessaire():
+    # Au démarrage : import automatique des données seulement si la base est neuve
+    with _verrou:
+        vide = connexion().execute("SELECT COUNT(*) FROM utilisateurs").fetchone()[0] == 0
+    importes = migrer() if vide and os.path.isdir(ANCIEN_DOSSIER) else 0
+    return importes + migrer_comptes()
+
+
+if __name__ == "__main__":
+    # python -m backend.storage [dossier]
+    dossier = sys.argv[1] if len(sys.argv) > 1 else ANCIEN_DOSSIER
+    print(f"{migrer(dossier)} documents importés dans {DB_PATH}")
+    print(f"{migrer_comptes()} comptes importés depuis {ANCIEN_USERS}")
@@ -1,19 +1,62 @@
-import os
 import json
+from contextvars import ContextVar
+from backend import storage
 
-DATA_ROOT = "backend/data/utilisateurs"
+JOURS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+
+# Utilisateur "figé" pour les traitements en arrière-plan (jobs) : prioritaire sur la session
+email_courant = ContextVar("email_courant", default=None)
+# Écritures différées (traitements par lot) : {nom: contenu} gardé en mémoire puis écrit en une transaction
+ecritures_differees = ContextVar("ecritures_differees", default=None)
 
 def get_user_email():
+    email = email_courant.get()
+    if email:
+        return email
     try:
-        with open("backend/data/session.json", "r", encoding="utf-8") as f:
-            session = json.load(f)
-            return session.get("email", None)
+        return storage.lire_session()
     except:
         return None
 
 
-def user_file_path(filename: str):
+# Documents de l'utilisateur connecté (remplacent les anciens fichiers <nom>.json)
+def lire_document(nom: str) -> dict:
+    tampon = ecritures_differees.get()
+    if tampon is not None and nom in tampon:
+        return json.loads(json.dumps(tampon[nom]))
+    return storage.lire(nom, get_user_email())
+
+
+def ecrire_document(nom: str, contenu: dict) -> int:
+    tampon = ecritures_differees.get()
+    if tampon is not None:
+        tampon[nom] = contenu
+        return 0
+    return storage.ecrire(nom, contenu, get_user_email())
+
+
+def modifier_document(nom: str, modifier, tentatives: int = 3) -> dict:
+    # Lecture-modification-écriture protégée par le numéro de version : si quelqu'un a écrit entre-temps
+    # (autre requête, autre worker), on relit et on réapplique `modifier(contenu)` sur la version fraîche.
+    # `modifier` reçoit None si le document n'existe pas encore.
+    if ecritures_differees.get() is not None:
+        try:
+            contenu = lire_document(nom)
+        except storage.DocumentIntrouvable:
+            contenu = None
+        contenu = modifier(contenu)
+        ecrire_document(nom, contenu)
+        return contenu
     email = get_user_email()
-    if not email:
-        return f"backend/data/{filename}"  # fallback si pas d'email
-    return os.path.join(DATA_ROOT, email, filename)
+    for _ in range(tentatives):
+        try:
+            contenu, version = storage.lire_avec_version(nom, email)
+        except storage.DocumentIntrouvable:
+            contenu, version = None, 0
+        contenu = modifier(contenu)
+        try:
+            storage.ecrire(nom, contenu, email, version_attendue=version)
+            return contenu
+        except storage.ConflitVersion:
+            continue
+    raise storage.ConflitVersion(f"{nom} : trop d'écritures concurrentes")
@@ -0,0 +1,291 @@
+import os
+import re
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import statistics
+import httpx
+
+# Test de charge de bout en bout contre un faux OpenRouter (bench/mock_openrouter.py) : aucun crédit dépensé.
+# Lance le mock et l'appli (uvicorn) dans deux process, puis N utilisateurs virtuels enchaînent
+# register -> login -> /generer (attente du job) -> /regenerer/{jour} -> /coach -> /planning.
+# Résultat : p50/p95/p99, requêtes/s et retard de boucle asyncio de l'appli, écrits en JSON dans bench/resultats/.
+# Usage : python bench/bench_charge.py --utilisateurs 20 [--comparer bench/resultats/ancien.json]
+RACINE = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+RESULTATS = os.path.join(RACINE, "bench", "resultats")
+TERMINAUX = ("termine", "echoue")
+
+# valeurs des <select> de templates/formulaire.html : les profils proches tombent sur la bibliothèque de semaines
+SEXES = ["Homme", "Femme"]
+ACTIVITES = ["très actif", "moyennement actif", "sédentaire"]
+OBJECTIFS = ["perte de graisse", "prise de muscle", "performance sportive"]
+
+
+def formulaire(i: int) -> dict:
+    # Profils variés mais voisins (même régime, pas d'allergie) : comme un vrai afflux d'inscriptions
+    return {
+        "age": str(25 + i % 15), "poids": str(65 + i % 20), "taille": str(165 + i % 20),
+        "sexe": SEXES[i % 2], "activite": ACTIVITES[i // 2 % 3], "objectif": OBJECTIFS[i // 6 % 3],
+        "sport_actuel": "course à pied", "sport_passe": "football", "deja_essaye": "non", "reussi": "non",
+        "temps_dispo": "45", "regime": "Aucun", "budget": str(50 + 10 * (i % 3)), "physique": "non",
+        "allergies": "aucune", "precision": "", "jours_sport": ["Lundi", "Mercredi", "Vendredi"],
+    }
+
+
+def port_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(durees: list) -> dict:
+    if not durees:
+        return {"n": 0}
+    durees = sorted(durees)
+
+    def rang(p):
+        return durees[min(len(durees) - 1, int(p * len(durees)))]
+
+    return {
+        "n": len(durees),
+        "p50_ms": round(statistics.median(durees) * 1000, 1),
+        "p95_ms": round(rang(0.95) * 1000, 1),
+        "p99_ms": round(rang(0.99) * 1000, 1),
+        "max_ms": round(durees[-1] * 1000, 1),
+    }
+
+
+def version_git() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RACINE, capture_output=True, text=True).stdout.strip() or "inconnue"
+    except OSError:
+        return "inconnue"
+
+
+def lancer(commande: list, env: dict, journal: str) -> subprocess.Popen:
+    with open(journal, "w") as sortie:
+        return subprocess.Popen(commande, cwd=RACINE, env=env, stdout=sortie, stderr=subprocess.STDOUT)
+
+
+async def attendre_serveur(url: str, delai: float = 20):
+    fin = time.monotonic() + delai
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < fin:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} ne répond pas")
+
+
+class Mesures:
+    def __init__(self):
+        self.durees = {}
+        self.erreurs = {}
+
+    def ajouter(self, nom: str, duree: float, ok: bool):
+        self.durees.setdefault(nom, []).append(duree)
+        if not ok:
+            self.erreurs[nom] = self.erreurs.get(nom, 0) + 1
+
+
+async def requete(client: httpx.AsyncClient, mesures: Mesures, nom: str, methode: str, url: str, **kwargs) -> httpx.Response:
+    debut = time.perf_counter()
+    try:
+        reponse = await client.request(methode, url, **kwargs)
+    except httpx.HTTPError:
+        mesures.ajouter(nom, time.perf_counter() - debut, False)
+        return None
+    mesures.ajouter(nom, time.perf_counter() - debut, reponse.status_code < 400)
+    return reponse
+
+
+def job_de(reponse: httpx.Response):
+    if reponse is None:
+        return None
+    trouve = re.search(r"job=([0-9a-f]+)", reponse.headers.get("location", ""))
+    return trouve.group(1) if trouve else None
+
+
+async def attendre_job(jobs_dir: str, job_id: str, delai: float):
+    # On lit le fichier du job plutôt que /jobs/{id} : la session de l'appli est globale,
+    # un autre utilisateur virtuel qui se connecte entre-temps ferait répondre 404.
+    chemin = os.path.join(jobs_dir, f"{job_id}.json")
+    fin = time.monotonic() + delai
+    while time.monotonic() < fin:
+        try:
+            with open(chemin, "r", encoding="utf-8") as f:
+                job = json.load(f)
+            if job["statut"] in TERMINAUX:
+                return job
+        except (OSError, ValueError):
+            pass
+        await asyncio.sleep(0.1)
+    return None
+
+
+async def utilisateur(i: int, base: str, jobs_dir: str, mesures: Mesures, delai_job: float, mot_de_passe: str):
+    email = f"bench{i}-{int(time.time())}@exemple.fr"
+    identifiants = {"email": email, "password": mot_de_passe}
+    async with httpx.AsyncClient(base_url=base, timeout=120) as client:
+        await requete(client, mesures, "POST /register", "POST", "/register", data=identifiants)
+        await requete(client, mesures, "POST /login", "POST", "/login", data=identifiants)
+
+        reponse = await requete(client, mesures, "POST /generer", "POST", "/generer", data=formulaire(i))
+        job_id = job_de(reponse)
+        if job_id:
+            debut = time.perf_counter()
+            job = await attendre_job(jobs_dir, job_id, delai_job)
+            mesures.ajouter("job generer", time.perf_counter() - debut, job is not None and job["statut"] == "termine")
+
+        reponse = await requete(client, mesures, "GET /regenerer/{jour}", "GET", "/regenerer/Mardi")
+        job_id = job_de(reponse)
+        if job_id:
+            debut = time.perf_counter()
+            job = await attendre_job(jobs_dir, job_id, delai_job)
+            mesures.ajouter("job regenerer", time.perf_counter() - debut, job is not None and job["statut"] == "termine")
+
+        await requete(client, mesures, "POST /coach", "POST", "/coach", data={"message": "Remplace le poisson de mardi par du poulet"})
+        await requete(client, mesures, "POST /coach (question)", "POST", "/coach", data={"message": "Pourquoi manger des légumes ?"})
+        await requete(client, mesures, "GET /planning", "GET", "/planning")
+
+
+async def sonder_boucle(base: str, arret: asyncio.Event, echantillons: list):
+    # retard de boucle mesuré DANS l'appli (jauge boucle_retard_secondes de /metrics)
+    async with httpx.AsyncClient(base_url=base, timeout=10) as client:
+        while not arret.is_set():
+            try:
+                texte = (await client.get("/metrics")).text
+                trouve = re.search(r"^boucle_retard_secondes (\S+)$", texte, re.M)
+                if trouve:
+                    echantillons.append(float(trouve.group(1)))
+            except httpx.HTTPError:
+                pass
+            try:
+                await asyncio.wait_for(arret.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+
+def comparer(ancien: dict, nouveau: dict):
+    print(f"\nComparaison avec {ancien['version']} ({ancien['date']}) :")
+    for nom, stats in nouveau["endpoints"].items():
+        avant = ancien["endpoints"].get(nom)
+        if not avant or not avant.get("n") or not stats.get("n"):
+            continue
+        ecart = (stats["p95_ms"] - avant["p95_ms"]) / avant["p95_ms"] * 100 if avant["p95_ms"] else 0
+        signe = "⚠️ " if ecart > 10 else "   "
+        print(f"{signe}{nom:28} p95 {avant['p95_ms']:>9} -> {stats['p95_ms']:>9} ms ({ecart:+.0f} %)")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Test de charge avec un faux OpenRouter")
+    parser.add_argument("--utilisateurs", type=int, default=10)
+    parser.add_argument("--latence", type=float, default=0.8, help="médiane du délai avant le premier token (s)")
+    parser.add_argument("--sigma", type=float, default=0.5, help="dispersion log-normale de la latence")
+    parser.add_argument("--debit", type=float, default=150, help="tokens par seconde")
+    parser.add_argument("--erreurs", type=float, default=0.02, help="taux de HTTP 500")
+    parser.add_argument("--erreurs-429", type=float, default=0.01)
+    parser.add_argument("--delai-job", type=float, default=300)
+    parser.add_argument("--scrypt-n", type=int, default=None, help="coût scrypt de l'appli (défaut : celui de prod)")
+    parser.add_argument("--env", action="append", default=[], help="variable de l'appli, ex. --env MODE_GENERATION=semaine")
+    parser.add_argument("--sortie", default=None)
+    parser.add_argument("--comparer", default=None)
+    args = parser.parse_args()
+
+    dossier = tempfile.mkdtemp(prefix="bench_charge_")
+    jobs_dir = os.path.join(dossier, "jobs")
+    port_mock, port_app = port_libre(), port_libre()
+
+    env_mock = dict(
+        os.environ, MOCK_LATENCE_MEDIANE=str(args.latence), MOCK_LATENCE_SIGMA=str(args.sigma),
+        MOCK_DEBIT_TOKENS=str(args.debit), MOCK_TAUX_ERREUR=str(args.erreurs), MOCK_TAUX_429=str(args.erreurs_429),
+    )
+    env_app = dict(
+        os.environ,
+        CLAUDE_URL=f"http://127.0.0.1:{port_mock}/api/v1/chat/completions",
+        OPENROUTER_API_KEY="bench",
+        DB_PATH=os.path.join(dossier, "bench.db"),
+        JOBS_DIR=jobs_dir,
+        ROUTAGE_JOURNAL=os.path.join(dossier, "routage.jsonl"),
+        ANCIEN_DOSSIER=os.path.join(dossier, "utilisateurs"),
+        ANCIEN_USERS=os.path.join(dossier, "users.json"),
+        STATIQUE_CACHE=os.path.join(dossier, "static"),
+        LLM_MODELES=os.path.join(dossier, "modeles.json"),
+        LLM_CACHE="0",  # sinon tout le monde tombe sur la même réponse en cache
+        JOBS_FILE_MAX=str(max(100, args.utilisateurs * 2)),
+    )
+    if args.scrypt_n:
+        env_app["SCRYPT_N"] = str(args.scrypt_n)
+    for reglage in args.env:
+        cle, _, valeur = reglage.partition("=")
+        env_app[cle] = valeur
+
+    mock = lancer([sys.executable, "-m", "uvicorn", "mock_openrouter:app", "--app-dir", "bench", "--port", str(port_mock), "--log-level", "warning"],
+                  env_mock, os.path.join(dossier, "mock.log"))
+    appli = lancer([sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port_app), "--log-level", "warning"],
+                   env_app, os.path.join(dossier, "appli.log"))
+    base = f"http://127.0.0.1:{port_app}"
+    try:
+        await attendre_serveur(f"http://127.0.0.1:{port_mock}/stats")
+        await attendre_serveur(f"{base}/metrics")
+
+        mesures = Mesures()
+        arret = asyncio.Event()
+        retards = []
+        sonde = asyncio.create_task(sonder_boucle(base, arret, retards))
+        debut = time.perf_counter()
+        await asyncio.gather(*(utilisateur(i, base, jobs_dir, mesures, args.delai_job, "motdepasse-bench") for i in range(args.utilisateurs)))
+        duree_totale = time.perf_counter() - debut
+        arret.set()
+        await sonde
+
+        async with httpx.AsyncClient() as client:
+            stats_mock = (await client.get(f"http://127.0.0.1:{port_mock}/stats")).json()
+            metriques = (await client.get(f"{base}/metrics")).text
+        retard_max = re.search(r"^boucle_retard_max_secondes (\S+)$", metriques, re.M)
+    finally:
+        for process in (appli, mock):
+            process.terminate()
+            process.wait(timeout=10)
+
+    endpoints = {}
+    for nom, durees in mesures.durees.items():
+        endpoints[nom] = dict(percentiles(durees), erreurs=mesures.erreurs.get(nom, 0), rps=round(len(durees) / duree_totale, 2))
+    resultat = {
+        "version": version_git(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {k: v for k, v in vars(args).items() if k not in ("sortie", "comparer")},
+        "duree_s": round(duree_totale, 2),
+        "requetes_par_s": round(sum(len(d) for nom, d in mesures.durees.items() if not nom.startswith("job")) / duree_totale, 2),
+        "endpoints": endpoints,
+        "boucle": dict(
+            percentiles(retards),
+            max_depuis_demarrage_ms=round(float(retard_max.group(1)) * 1000, 1) if retard_max else None,
+        ),
+        "mock": stats_mock,
+    }
+
+    os.makedirs(RESULTATS, exist_ok=True)
+    sortie = args.sortie or os.path.join(RESULTATS, f"charge-{resultat['version']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(sortie, "w", encoding="utf-8") as f:
+        json.dump(resultat, f, ensure_ascii=False, indent=2)
+
+    print(f"{args.utilisateurs} utilisateurs en {resultat['duree_s']} s, {resultat['requetes_par_s']} req/s")
+    for nom, stats in endpoints.items():
+        print(f"{nom:28} n={stats['n']:<4} p50={stats.get('p50_ms')} p95={stats.get('p95_ms')} p99={stats.get('p99_ms')} ms erreurs={stats['erreurs']}")
+    print(f"retard de boucle : {resultat['boucle']}")
+    print(f"résultats : {sortie} (journaux dans {dossier})")
+    if args.comparer:
+        with open(args.comparer, "r", encoding="utf-8") as f:
+            comparer(json.load(f), resultat)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
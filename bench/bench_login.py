@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import statistics
+
+# Latence de connexion avec N comptes : ancien users.json vs base SQLite indexée + scrypt hors boucle.
+# Usage : python bench/bench_login.py [nb_comptes] [nb_connexions]
+NB_COMPTES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+NB_CONNEXIONS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+dossier = tempfile.mkdtemp(prefix="bench_login_")
+os.environ["DB_PATH"] = os.path.join(dossier, "bench.db")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from backend import storage, auth  # noqa: E402
+
+
+def percentiles(durees):
+    durees = sorted(durees)
+    return {
+        "p50_ms": round(statistics.median(durees) * 1000, 3),
+        "p95_ms": round(durees[int(len(durees) * 0.95) - 1] * 1000, 3),
+        "max_ms": round(durees[-1] * 1000, 3),
+    }
+
+
+def preparer():
+    # Une seule empreinte réutilisée : hacher 100k mots de passe prendrait des heures
+    empreinte = auth.hacher("motdepasse")
+    debut = time.perf_counter()
+    with storage.transaction() as db:
+        db.executemany(
+            "INSERT INTO utilisateurs (email, cree, mot_de_passe) VALUES (?, ?, ?)",
+            ((f"user{i}@exemple.fr", time.time(), empreinte) for i in range(NB_COMPTES)),
+        )
+    print(f"{NB_COMPTES} comptes insérés en {time.perf_counter() - debut:.1f}s")
+
+    users_json = os.path.join(dossier, "users.json")
+    with open(users_json, "w", encoding="utf-8") as f:
+        json.dump({f"user{i}@exemple.fr": "motdepasse" for i in range(NB_COMPTES)}, f)
+    return users_json
+
+
+def ancien_login(users_json, email, mot_de_passe):
+    with open(users_json, "r", encoding="utf-8") as f:
+        users = json.load(f)
+    return users.get(email) == mot_de_passe
+
+
+async def nouveau_login(email, mot_de_passe):
+    empreinte = storage.lire_empreinte(email)
+    return await auth.verifier_async(mot_de_passe, empreinte or auth.EMPREINTE_FACTICE)
+
+
+async def decalage_boucle(arret):
+    # retard max du réveil d'une tâche toutes les 10 ms : mesure le blocage de la boucle
+    pire = 0.0
+    while not arret.is_set():
+        avant = time.perf_counter()
+        await asyncio.sleep(0.01)
+        pire = max(pire, time.perf_counter() - avant - 0.01)
+    return pire
+
+
+async def main():
+    users_json = preparer()
+    emails = [f"user{(i * 7919) % NB_COMPTES}@exemple.fr" for i in range(NB_CONNEXIONS)]
+
+    durees = []
+    for email in emails[:20]:
+        debut = time.perf_counter()
+        ancien_login(users_json, email, "motdepasse")
+        durees.append(time.perf_counter() - debut)
+    print("ancien (users.json, en clair) :", percentiles(durees))
+
+    durees = []
+    for email in emails:
+        debut = time.perf_counter()
+        storage.lire_empreinte(email)
+        durees.append(time.perf_counter() - debut)
+    print("recherche indexée seule      :", percentiles(durees))
+
+    arret = asyncio.Event()
+    sonde = asyncio.create_task(decalage_boucle(arret))
+    durees = []
+    for email in emails:
+        debut = time.perf_counter()
+        assert await nouveau_login(email, "motdepasse")
+        durees.append(time.perf_counter() - debut)
+    arret.set()
+    print(f"nouveau (SQLite + scrypt n={auth.SCRYPT_N}) :", percentiles(durees))
+    print(f"pire blocage de la boucle pendant les connexions : {await sonde * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import math
+import random
+import asyncio
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Faux endpoint OpenRouter /api/v1/chat/completions pour les benchmarks (aucun crédit dépensé).
+# Lancement : uvicorn mock_openrouter:app --app-dir bench --port 8901, puis CLAUDE_URL=http://127.0.0.1:8901/api/v1/chat/completions
+# Réglages : délai avant le premier token (loi log-normale), débit de tokens, taux d'erreurs 500 / 429.
+LATENCE_MEDIANE = float(os.getenv("MOCK_LATENCE_MEDIANE", "0.8"))  # s avant le premier token
+LATENCE_SIGMA = float(os.getenv("MOCK_LATENCE_SIGMA", "0.5"))
+DEBIT_TOKENS = float(os.getenv("MOCK_DEBIT_TOKENS", "150"))  # tokens générés par seconde
+TAUX_ERREUR = float(os.getenv("MOCK_TAUX_ERREUR", "0.02"))  # HTTP 500
+TAUX_429 = float(os.getenv("MOCK_TAUX_429", "0.01"))
+GRAINE = os.getenv("MOCK_GRAINE")
+
+app = FastAPI()
+_hasard = random.Random(int(GRAINE) if GRAINE else None)
+_compteurs = {"requetes": 0, "erreurs": 0, "streams": 0}
+
+ALIMENTS = [
+    ("flocons d'avoine", 60), ("lait demi-écrémé", 200), ("banane", 120), ("blanc de poulet", 150), ("riz basmati", 80),
+    ("brocoli", 150), ("saumon", 130), ("pâtes complètes", 90), ("courgette", 150), ("oeufs", 100), ("yaourt nature", 125),
+    ("lentilles", 70), ("carottes", 120), ("pain complet", 60), ("pomme", 150), ("fromage blanc", 150),
+]
+JOURS = ["Lundi", "Mardi", "Mercredi", "Jeudi", "Vendredi", "Samedi", "Dimanche"]
+
+
+def _repas():
+    return {nom: [{"aliment": a, "grammes": g} for a, g in _hasard.sample(ALIMENTS, 3)] for nom in ("matin", "midi", "soir")}
+
+
+def _reponse(prompt: str) -> str:
+    # Contenu plausible selon le type de prompt, pour que l'appli suive ses vrais chemins de code
+    if '"intention"' in prompt:
+        return json.dumps({"intention": "modifnutrition", "jours": ["Mardi"]})
+    if '"modifications"' in prompt:
+        return json.dumps({"modifications": []})
+    if "objet JSON valide" in prompt:
+        return json.dumps({jour: _repas() for jour in JOURS}, ensure_ascii=False)
+    if "liste de courses" in prompt:
+        return "\n".join(f"- {a} : {g * 7} g" for a, g in ALIMENTS)
+    if "coach sportif" in prompt:
+        return "\n".join(f"{jour} :\n- Squat 4x10\n- Pompes 3x12\n- Gainage 3x45 s\n- Fentes 3x10\n- Étirements 10 min" for jour in JOURS[:3])
+    lignes = []
+    for nom, aliments in _repas().items():
+        lignes.append(f"{nom.capitalize()} :")
+        lignes += [f"- {a['aliment']} : {a['grammes']} g" for a in aliments]
+    return "\n".join(lignes)
+
+
+def _tokens(texte: str) -> int:
+    return max(1, len(texte) // 4)
+
+
+def _usage(prompt: str, texte: str) -> dict:
+    return {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(texte), "total_tokens": _tokens(prompt) + _tokens(texte)}
+
+
+@app.post("/api/v1/chat/completions")
+async def completions(request: Request):
+    data = await request.json()
+    _compteurs["requetes"] += 1
+    prompt = "\n".join(str(m.get("content", "")) for m in data.get("messages", []))
+    premier_token = _hasard.lognormvariate(math.log(LATENCE_MEDIANE), LATENCE_SIGMA)
+
+    tirage = _hasard.random()
+    if tirage < TAUX_ERREUR + TAUX_429:
+        _compteurs["erreurs"] += 1
+        await asyncio.sleep(premier_token / 2)
+        statut = 500 if tirage < TAUX_ERREUR else 429
+        return JSONResponse({"error": {"code": statut, "message": "erreur simulée"}}, status_code=statut)
+
+    texte = _reponse(prompt)
+    if not data.get("stream"):
+        await asyncio.sleep(premier_token + _tokens(texte) / DEBIT_TOKENS)
+        return {
+            "id": f"mock-{time.time_ns()}",
+            "model": data.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": texte}, "finish_reason": "stop"}],
+            "usage": _usage(prompt, texte),
+        }
+
+    _compteurs["streams"] += 1
+
+    async def morceaux():
+        yield ": OPENROUTER PROCESSING\n\n"
+        await asyncio.sleep(premier_token)
+        for i in range(0, len(texte), 16):  # ~4 tokens par morceau
+            morceau = texte[i:i + 16]
+            yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': morceau}}]}, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(_tokens(morceau) / DEBIT_TOKENS)
+        yield f"data: {json.dumps({'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}], 'usage': _usage(prompt, texte)})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(morceaux(), media_type="text/event-stream")
+
+
+@app.get("/stats")
+async def stats():
+    return _compteurs
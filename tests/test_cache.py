@@ -0,0 +1,36 @@
+import os
+import asyncio
+import threading
+from backend.cache import CacheLLM
+
+
+def test_ecriture_disque_hors_de_la_boucle(tmp_path):
+    cache = CacheLLM(str(tmp_path), ttl=60, memoire_max=10, disque_max=10 ** 6)
+    threads = []
+    ecrire_disque = cache._ecrire_disque
+
+    def espion(*args):
+        threads.append(threading.current_thread())
+        ecrire_disque(*args)
+
+    cache._ecrire_disque = espion
+
+    async def scenario():
+        cache.ecrire("ab12", "réponse")
+        assert cache._lire_memoire("ab12") == "réponse"  # niveau mémoire tout de suite
+        await cache.terminer_ecritures()
+
+    asyncio.run(scenario())
+    assert threads and threads[0] is not threading.main_thread()
+    assert os.path.isfile(os.path.join(str(tmp_path), "ab", "ab12.json"))
+
+    # nouveau process : seul le disque a l'entrée
+    froid = CacheLLM(str(tmp_path), ttl=60, memoire_max=10, disque_max=10 ** 6)
+    assert asyncio.run(froid.lire_async("ab12")) == "réponse"
+    assert froid.stats()["hit_disque"] == 1
+
+
+def test_ecriture_hors_boucle_reste_synchrone(tmp_path):
+    cache = CacheLLM(str(tmp_path), ttl=60, memoire_max=10, disque_max=10 ** 6)
+    cache.ecrire("cd34", "texte")
+    assert os.path.isfile(os.path.join(str(tmp_path), "cd", "cd34.json"))
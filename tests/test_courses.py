@@ -0,0 +1,44 @@
+import pytest
+from backend import courses
+
+
+def lire(texte):
+    non_lus = []
+    articles = [(a["nom"], a["quantite"], a["unite"]) for a in courses.parser_jour(texte, non_lus)]
+    return articles, non_lus
+
+
+@pytest.mark.parametrize("ligne, attendu", [
+    ("- Riz basmati : 80 g (poids cru)", [("riz basmati", 80, "g")]),
+    ("Salade verte et tomates : 150 g", [("salade verte et tomate", 150, "g")]),
+    ("Pain complet : 2 tranches (60 g)", [("pain complet", 60, "g")]),
+    ("Yaourt nature : 1 (125 g)", [("yaourt nature", 125, "g")]),
+    ("Riz basmati (80 g)", [("riz basmati", 80, "g")]),
+    ("Midi : poulet 150 g et riz 80 g, huile d'olive 1 c. à soupe",
+     [("poulet", 150, "g"), ("riz", 80, "g"), ("huile d'olive", 1, "c. à soupe")]),
+    ("Lait 1,5 l", [("lait", 1500, "ml")]),
+    ("Pâtes 70-80 g", [("pâte", 80, "g")]),
+    ("2 œufs", [("œuf", 2, "pièce")]),
+])
+def test_parser_jour(ligne, attendu):
+    articles, non_lus = lire(ligne)
+    assert articles == attendu
+    assert non_lus == []
+
+
+def test_morceaux_illisibles_signales():
+    articles, non_lus = lire("Flocons d'avoine : 1/2 bol\nEau à volonté\nTotal : 1800 kcal")
+    assert articles == []
+    assert non_lus == ["Flocons d'avoine : 1/2 bol"]
+
+
+def test_liste_affiche_les_non_lus_et_mise_a_jour():
+    liste = courses.construire({"Lundi": "Riz 80 g\nFlocons d'avoine : 1/2 bol", "Mardi": "Riz 50 g"})
+    assert liste["non_lus"] == {"Lundi": ["Flocons d'avoine : 1/2 bol"]}
+    assert "À vérifier" in liste["liste"]
+    assert "riz : 130 g" in liste["liste"]
+
+    liste = courses.remplacer_jours(liste, {"Lundi": "Riz 10 g"}, ["Lundi"])
+    assert liste["non_lus"] == {}
+    assert "À vérifier" not in liste["liste"]
+    assert "riz : 60 g" in liste["liste"]
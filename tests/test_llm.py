@@ -0,0 +1,60 @@
+import json
+import time
+import asyncio
+import httpx
+import pytest
+from backend import llm
+
+
+def sse(*textes) -> bytes:
+    lignes = [f"data: {json.dumps({'choices': [{'delta': {'content': t}}]})}\n\n" for t in textes]
+    return ("".join(lignes) + "data: [DONE]\n\n").encode()
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    # installe un client httpx branché sur `gestionnaire(requete, n)` (n = numéro de l'appel)
+    monkeypatch.setattr(llm, "CACHE_ACTIF", False)
+    monkeypatch.setattr(llm, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(llm, "_disjoncteurs", {})
+    appels = []
+
+    def installer(gestionnaire):
+        def repondre(requete):
+            appels.append(requete)
+            return gestionnaire(requete, len(appels))
+        monkeypatch.setattr(llm, "_client", httpx.AsyncClient(transport=httpx.MockTransport(repondre)))
+        return appels
+
+    return installer
+
+
+async def lire_flux(**kwargs) -> str:
+    return "".join([morceau async for morceau in llm.streamer("bonjour", modele="test", **kwargs)])
+
+
+def test_stream_reessaie_apres_429(transport):
+    appels = transport(lambda requete, n: httpx.Response(429) if n == 1 else httpx.Response(200, content=sse("Lun", "di")))
+    assert asyncio.run(lire_flux()) == "Lundi"
+    assert len(appels) == 2
+
+
+def test_stream_abandonne_apres_tentatives_max(transport):
+    appels = transport(lambda requete, n: httpx.Response(503))
+    with pytest.raises(llm.ErreurTransitoire):
+        asyncio.run(lire_flux())
+    assert len(appels) == llm.TENTATIVES_MAX
+
+
+def test_stream_borne_par_la_deadline_malgre_les_keep_alive(transport):
+    class KeepAlive(httpx.AsyncByteStream):
+        async def __aiter__(self):
+            while True:
+                yield b": OPENROUTER PROCESSING\n\n"
+                await asyncio.sleep(0.05)
+
+    transport(lambda requete, n: httpx.Response(200, stream=KeepAlive()))
+    debut = time.perf_counter()
+    with pytest.raises(llm.ErreurIA, match="Délai"):
+        asyncio.run(lire_flux(delai=0.3))
+    assert time.perf_counter() - debut < 1.5
@@ -0,0 +1,42 @@
+import pytest
+from backend.routage import classer_localement, SEUIL_CONFIANCE
+
+
+@pytest.mark.parametrize("message", [
+    "Comment faire des pompes sans matériel ?",
+    "Comment faire plus de pompes ?",
+    "Combien de séries je dois faire au lieu de 3 ?",
+    "Pourquoi manger plus de protéines le soir ?",
+    "Est-ce que je peux remplacer le riz par des pâtes ?",
+])
+def test_question_avec_mot_de_modification_passe_par_l_ia(message):
+    assert classer_localement(message)["confiance"] < SEUIL_CONFIANCE
+
+
+@pytest.mark.parametrize("message", [
+    "Pourquoi le cardio est important ?",
+    "C'est quoi le gainage ?",
+])
+def test_question_pure_sans_modification(message):
+    decision = classer_localement(message)
+    assert decision["intention"] == "nomodif"
+    assert decision["confiance"] >= SEUIL_CONFIANCE
+
+
+@pytest.mark.parametrize("message, intention, jours", [
+    ("Remplace les squats par du vélo mardi", "modifsport", ["Mardi"]),
+    ("Enlève la séance de cardio", "modifsport", []),
+    ("Je ne veux plus de poisson lundi", "modifnutrition", ["Lundi"]),
+    ("Change le dîner de samedi et dimanche", "modifnutrition", ["Samedi", "Dimanche"]),
+])
+def test_demande_de_modification_sur_le_chemin_rapide(message, intention, jours):
+    decision = classer_localement(message)
+    assert decision["intention"] == intention
+    assert decision["jours"] == jours
+    assert decision["confiance"] >= SEUIL_CONFIANCE
+
+
+def test_modification_nutrition_sans_jour_passe_par_l_ia():
+    decision = classer_localement("Je ne veux plus de poisson")
+    assert decision["intention"] == "modifnutrition"
+    assert decision["confiance"] < SEUIL_CONFIANCE
@@ -0,0 +1,38 @@
+import sqlite3
+import pytest
+from backend import storage
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    chemin = str(tmp_path / "test.db")
+    monkeypatch.setattr(storage, "DB_PATH", chemin)
+    monkeypatch.setattr(storage, "_connexion", None)
+    monkeypatch.setattr(storage, "_data_version", None)
+    storage._cache.clear()
+    yield chemin
+    storage._connexion.close()
+    storage._cache.clear()
+
+
+def test_ecriture_d_un_autre_process_visible_apres_notre_transaction(base):
+    storage.ecrire("planning", {"plannings": {"Lundi": "v1"}}, "a@x")
+    assert storage.lire_avec_version("planning", "a@x") == ({"plannings": {"Lundi": "v1"}}, 1)
+
+    # autre worker / CLI batch : une autre connexion à la même base
+    autre = sqlite3.connect(base, isolation_level=None)
+    autre.execute("UPDATE plannings SET contenu = ?, version = version + 1 WHERE email = ?", ('{"plannings": {"Lundi": "v2"}}', "a@x"))
+    autre.close()
+
+    # notre propre transaction ne doit pas absorber le changement de data_version
+    storage.ecrire("liste", {"liste": "riz"}, "b@x")
+    assert storage.lire_avec_version("planning", "a@x") == ({"plannings": {"Lundi": "v2"}}, 2)
+    assert storage.etat("planning", "a@x")[0] == 2
+
+
+def test_cache_borne(base, monkeypatch):
+    monkeypatch.setattr(storage, "CACHE_MAX", 3)
+    for i in range(10):
+        storage.ecrire("planning", {"i": i}, f"u{i}@x")
+    assert len(storage._cache) <= 3
+    assert storage.lire("planning", "u0@x") == {"i": 0}